@@ -1,9 +1,23 @@
 # agent.py
-from typing import List, Dict, Optional
-from openai import OpenAI
+import copy
+import time
+from typing import Iterator, List, Dict, Optional, Union
+from utils.llm_client import get_client
+from utils.llm_utils import chat_completion, stream_chat_completion
+from utils.summarizer import condense_transcript
+from utils.token_utils import content_text, history_budget, message_tokens, messages_tokens
+
+# 超出预算时至少保留最近几条消息原文 (当前这一轮 + 上一轮问答)
+KEEP_RECENT_MESSAGES = 3
+# 折叠后把历史压到预算的多少比例，留出余量，避免每一轮都触发摘要
+FOLD_TARGET_RATIO = 0.6
+# 滚动摘要的长度上限 (token)
+SUMMARY_MAX_TOKENS = 1500
+# 送去摘要时每条旧消息最多取多少字 (旧的 PDF 背景资料不必全文重读)
+FOLD_MESSAGE_CHARS = 3000
 
 class ResearchAgent:
-    def __init__(self, name: str, system_prompt: str, model: str, api_key: str, base_url: str = None):
+    def __init__(self, name: str, system_prompt: str, model: str, api_key: str, base_url: str = None, token_budget: Optional[int] = None):
         """
         初始化科研代理人
         :param name: 名字 (e.g. "论文精读助手")
@@ -11,29 +25,112 @@ class ResearchAgent:
         :param model: 模型名称 (e.g. "gpt-4o", "deepseek-chat")
         :param api_key: API 密钥
         :param base_url: 模型服务商地址
+        :param token_budget: 每次请求中对话历史的 token 上限，默认按模型窗口计算
         """
         self.name = name
         self.model = model
         self.system_prompt = system_prompt
         
         # 1. 初始化客户端 (支持多模型的核心)
-        if base_url:
-            self.client = OpenAI(api_key=api_key, base_url=base_url)
-        else:
-            self.client = OpenAI(api_key=api_key) # 默认连 OpenAI
+        # 同一服务商共用一个连接池；base_url 为空时默认连 OpenAI
+        self.client = get_client(api_key, base_url)
             
         # 2. 初始化记忆
         self.history: List[Dict] = [
             {"role": "system", "content": system_prompt}
         ]
 
-    def chat(self, user_input: str, image_base64: Optional[str] = None) -> str:
+        # 3. 最近一次流式调用的耗时 (秒)：首字延迟 / 总耗时
+        self.last_ttft: Optional[float] = None
+        self.last_latency: Optional[float] = None
+
+        # 4. 上下文预算：history 保留完整记录 (供界面展示)，
+        #    但发给模型的只有 system + 滚动摘要 + history[self._folded:] 这些最近的原文
+        self.token_budget = token_budget or history_budget(model)
+        self.summary = ""
+        self._folded = 1
+
+    def _request_messages(self) -> List[Dict]:
+        """本次请求实际发送的消息"""
+        messages = [self.history[0]]
+        if self.summary:
+            messages.append({"role": "system", "content": f"【此前对话摘要】\n{self.summary}"})
+        messages.extend(self.history[self._folded:])
+        return messages
+
+    def _fit_budget(self):
         """
-        核心对话函数
-        :param user_input: 用户的文字输入
-        :param image_base64: 图片的 Base64 编码字符串 (可选)
+        请求超出预算时，把最早的若干条原文折叠进滚动摘要
+        最近 KEEP_RECENT_MESSAGES 条始终保留原文；每次送去摘要的旧对话也不超过预算
+        (从数据库恢复一段很长的历史时会分几次折叠)
         """
-        # A. 构建消息内容
+        total = messages_tokens(self._request_messages())
+        if total <= self.token_budget:
+            return
+
+        target = int(self.token_budget * FOLD_TARGET_RATIO)
+        keep_from = len(self.history) - KEEP_RECENT_MESSAGES
+        while total > target and self._folded < keep_from:
+            end, chunk_tokens = self._folded, 0
+            while end < keep_from and total > target and chunk_tokens < self.token_budget:
+                tokens = message_tokens(self.history[end])
+                total -= tokens
+                chunk_tokens += tokens
+                end += 1
+            # 按“问-答”成对折叠，避免剩下一条没有提问的回答
+            if end < keep_from and self.history[end]["role"] == "assistant":
+                total -= message_tokens(self.history[end])
+                end += 1
+
+            old_summary_tokens = message_tokens({"content": self.summary}) if self.summary else 0
+            self.summary = self._update_summary(self.history[self._folded:end])
+            self._folded = end
+            total += message_tokens({"content": self.summary}) - old_summary_tokens
+
+    def _update_summary(self, messages: List[Dict]) -> str:
+        """把一段旧对话并入滚动摘要 (增量更新，不重读已摘要的部分)"""
+        lines = []
+        for m in messages:
+            text = content_text(m["content"])
+            if len(text) > FOLD_MESSAGE_CHARS:
+                text = text[:FOLD_MESSAGE_CHARS] + "……(已截断)"
+            lines.append(f"{m['role']}: {text}")
+        transcript = "\n".join(lines)
+
+        prompt = f"""
+        下面是一段对话的已有摘要，以及紧接其后的新对话。
+        请把新对话的要点并入摘要，输出更新后的完整摘要。
+        
+        【已有摘要】
+        {self.summary or "（无）"}
+        
+        【新对话】
+        {transcript}
+        
+        【要求】
+        1. 保留关键事实、结论、用户的问题与偏好、尚未解决的问题。
+        2. 删去寒暄和重复内容。
+        3. 不超过 {SUMMARY_MAX_TOKENS} 个 token，直接输出摘要正文。
+        """
+        try:
+            reply = chat_completion(
+                self.client,
+                self.model,
+                [
+                    {"role": "system", "content": "你负责为长对话维护一份精炼的滚动摘要。"},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=SUMMARY_MAX_TOKENS,
+            )
+            return reply.strip()
+        except Exception as e:
+            # 摘要失败时退化为保留一段截断的原文，保证请求仍在预算内
+            print(f"滚动摘要更新失败: {e}")
+            fallback = (self.summary + "\n" + transcript).strip()
+            return fallback[-SUMMARY_MAX_TOKENS:]
+
+    def _build_user_content(self, user_input: str, image_base64: Optional[str] = None):
+        """构建用户消息内容 (纯文本或图文混合)"""
         if image_base64:
             # --- 视觉模式 ---
             # 大多数兼容 OpenAI 视觉接口的模型都接受这种格式
@@ -47,19 +144,36 @@ class ResearchAgent:
         else:
             # --- 纯文本模式 ---
             content = user_input
+        return content
+
+    def _stream_completion(self, messages: List[Dict], use_cache: bool = True) -> Iterator[str]:
+        """流式调用 API，逐段产出文本，并记录首字延迟"""
+        start = time.perf_counter()
+        self.last_ttft = None
+        self.last_latency = None
+        for delta in stream_chat_completion(self.client, self.model, messages, use_cache=use_cache):
+            if self.last_ttft is None:
+                self.last_ttft = time.perf_counter() - start
+            yield delta
+        self.last_latency = time.perf_counter() - start
+
+    def chat(self, user_input: str, image_base64: Optional[str] = None, use_cache: bool = True) -> str:
+        """
+        核心对话函数
+        :param user_input: 用户的文字输入
+        :param image_base64: 图片的 Base64 编码字符串 (可选)
+        :param use_cache: 为 False 时强制重新生成，不使用缓存
+        """
+        # A. 构建消息内容
+        content = self._build_user_content(user_input, image_base64)
 
         # B. 用户消息入栈
         self.history.append({"role": "user", "content": content})
+        self._fit_budget()
 
         try:
-            # C. 调用 API
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=self.history,
-                stream=False, # 暂时不使用流式输出，保持逻辑简单
-            )
-            
-            reply = response.choices[0].message.content
+            # C. 调用 API (只发送预算内的上下文)
+            reply = chat_completion(self.client, self.model, self._request_messages(), use_cache=use_cache)
             
             # D. AI 回复入栈
             # 注意：即使输入是复杂的图文结构，AI 的回复通常只是纯文本
@@ -73,15 +187,78 @@ class ResearchAgent:
             self.history.pop() 
             return error_msg
 
+    def chat_stream(self, user_input: str, image_base64: Optional[str] = None, use_cache: bool = True) -> Iterator[str]:
+        """
+        流式版本的 chat：边生成边产出文本片段
+        完整回复只在生成结束后才写入 history；出错或中途被打断时撤回本轮用户消息。
+        接口出错时异常原样抛给调用方 (此前可能已产出部分内容，调用方不应把它当作完整回复保存)
+        """
+        content = self._build_user_content(user_input, image_base64)
+        self.history.append({"role": "user", "content": content})
+        self._fit_budget()
+
+        parts = []
+        try:
+            for delta in self._stream_completion(self._request_messages(), use_cache=use_cache):
+                parts.append(delta)
+                yield delta
+        except GeneratorExit:
+            # 调用方提前停止读取 (例如页面刷新)，这一轮不算数
+            self.history.pop()
+            raise
+        except Exception:
+            self.history.pop()
+            raise
+
+        self.history.append({"role": "assistant", "content": "".join(parts)})
+
+    def draft(self, user_input: str) -> Dict:
+        """
+        准备一轮对话的草稿 (不修改 history)，配合 complete_draft / commit_draft 使用：
+        先在后台生成回复，确定要用时再把这一轮写进 history
+        """
+        content = self._build_user_content(user_input)
+        # 在浅拷贝上按预算折叠：草稿请求和 chat() 一样不超预算，本体的 history / 摘要不受影响
+        view = copy.copy(self)
+        view.history = self.history + [{"role": "user", "content": content}]
+        view._fit_budget()
+        return {
+            "content": content,
+            "messages": view._request_messages(),
+            "base": len(self.history),
+            "last": self.history[-1],
+            # 折叠结果随草稿带走，提交时直接沿用，不再重新折叠 (可能要请求一次摘要)
+            "summary": view.summary,
+            "folded": view._folded,
+        }
+
+    def complete_draft(self, draft: Dict, use_cache: bool = True) -> str:
+        """为草稿生成回复 (只读草稿里的消息快照，可在后台线程调用)"""
+        reply = chat_completion(self.client, self.model, draft["messages"], use_cache=use_cache)
+        draft["reply"] = reply
+        return reply
+
+    def commit_draft(self, draft: Dict) -> bool:
+        """把已生成回复的草稿写进 history；草稿生成后 history 有变化时放弃并返回 False"""
+        if "reply" not in draft or len(self.history) != draft["base"] or self.history[-1] is not draft["last"]:
+            return False
+        self.history.append({"role": "user", "content": draft["content"]})
+        self.history.append({"role": "assistant", "content": draft["reply"]})
+        # 和 chat() 一样：发请求前折叠过的状态就是提交后的状态
+        self.summary = draft["summary"]
+        self._folded = draft["folded"]
+        return True
+
     def clear_memory(self):
         """清空对话历史，重置为初始状态"""
         self.history = [
             {"role": "system", "content": self.system_prompt}
         ]
-    def summarize(self, context: str, output_format: str = "markdown") -> str:
-        """
-        专门用于生成总结或报告
-        """
+        self.summary = ""
+        self._folded = 1
+
+    def _summary_messages(self, context: str, output_format: str) -> List[Dict]:
+        """构建生成纪要用的临时消息，不影响长期记忆"""
         prompt = f"""
         请根据以下对话记录，整理一份结构化的科研纪要。
         
@@ -96,23 +273,36 @@ class ResearchAgent:
            - 📌 下一步建议或结论 (Conclusion)
         3. 记录全面细致。
         """
-        
-        # 临时构建一条消息，不影响长期记忆
-        messages = [
+        return [
             {"role": "system", "content": "你是一名专业的学术编辑，擅长整理会议纪要。"},
             {"role": "user", "content": prompt}
         ]
-        
+
+    def _report_context(self, context: Union[str, List[Dict]], use_cache: bool) -> str:
+        """传入消息列表时先分段并发摘要，长记录压缩成各段要点"""
+        if isinstance(context, str):
+            return context
+        return condense_transcript(self.client, self.model, context, use_cache=use_cache)
+
+    def summarize(self, context: Union[str, List[Dict]], output_format: str = "markdown", use_cache: bool = True) -> str:
+        """
+        专门用于生成总结或报告
+        :param context: 拼好的对话记录文本，或消息列表 (长记录会先分段摘要再合并)
+        """
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                stream=False
-            )
-            return response.choices[0].message.content
+            messages = self._summary_messages(self._report_context(context, use_cache), output_format)
+            return chat_completion(self.client, self.model, messages, use_cache=use_cache)
         except Exception as e:
             return f"生成报告失败: {str(e)}"
 
+    def summarize_stream(self, context: Union[str, List[Dict]], output_format: str = "markdown", use_cache: bool = True) -> Iterator[str]:
+        """
+        流式版本的 summarize：边生成边产出纪要片段 (分段摘要阶段不产出，合并阶段流式输出)
+        接口出错时异常原样抛给调用方 (此前可能已产出部分内容，调用方不应把它当作完整报告保存)
+        """
+        messages = self._summary_messages(self._report_context(context, use_cache), output_format)
+        yield from self._stream_completion(messages, use_cache=use_cache)
+
 def main():
     """测试代码"""
     agent = ResearchAgent(
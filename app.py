@@ -4,9 +4,14 @@ import json
 import asyncio
 from agent import ResearchAgent
 from meeting import MeetingController
-from focus_mode import FocusSession
+from focus_mode import FocusSession, THINK_DEADLINE_SECONDS
 from utils.file_utils import extract_text_from_pdf, encode_image_to_base64
-from utils.db_utils import create_session, get_all_sessions, get_session_info, add_message, get_messages, delete_session
+from utils.minutes import minutes_context, pending_messages, schedule_minutes_update
+from utils.llm_cache import llm_cache
+from utils.db_utils import create_session, get_all_sessions, get_session_info, add_message, get_messages, iter_messages, delete_session, enable_write_behind, search_messages, search_sessions, load_focus_state, get_minutes
+
+# 消息写入走后台批量队列，一次交互里的多条消息 (用户输入 / insights / 回复) 合并成一个事务
+enable_write_behind()
 
 # --- 1. 页面配置 ---
 st.set_page_config(page_title="ScholarAI - 科研智囊团", page_icon="🎓", layout="wide")
@@ -48,6 +53,10 @@ with st.sidebar:
     }
     base_url = base_url_map[model_provider]
 
+    cache_stats = llm_cache.stats()
+    if cache_stats["hits"] or cache_stats["misses"]:
+        st.caption(f"⚡ 响应缓存命中 {cache_stats['hits']} / {cache_stats['hits'] + cache_stats['misses']}")
+
     st.divider()
     
     # === 会话列表管理 ===
@@ -60,6 +69,28 @@ with st.sidebar:
         st.session_state.meeting_controller = None
         st.rerun()
 
+    # 全文检索：会话标题 + 所有消息内容
+    search_query = st.text_input("🔍 搜索会话与消息", placeholder="输入关键词...")
+    if search_query.strip():
+        title_hits = search_sessions(search_query, limit=10)
+        message_hits = search_messages(search_query, limit=20)
+        if not title_hits and not message_hits:
+            st.caption("没有找到相关内容")
+        for s in title_hits:
+            if st.button(f"📁 {s['title']}", key=f"search_s_{s['session_id']}", use_container_width=True):
+                st.session_state.current_session_id = s['session_id']
+                st.session_state.agent = None
+                st.session_state.meeting_controller = None
+                st.rerun()
+        for hit in message_hits:
+            if st.button(f"💬 {hit['title']}", key=f"search_m_{hit['message_id']}", use_container_width=True):
+                st.session_state.current_session_id = hit['session_id']
+                st.session_state.agent = None
+                st.session_state.meeting_controller = None
+                st.rerun()
+            st.caption(f"{hit['role']}: {hit['snippet']}")
+        st.divider()
+
     # 显示历史会话
     sessions = get_all_sessions()
     if sessions:
@@ -76,6 +107,7 @@ with st.sidebar:
                 # 删除会话
                 if st.button("🗑️", key=f"del_{s['session_id']}"):
                     delete_session(s['session_id'])
+                    st.session_state.get("focus_sessions", {}).pop(s['session_id'], None)
                     if st.session_state.get('current_session_id') == s['session_id']:
                         st.session_state.current_session_id = None
                         st.session_state.agent = None
@@ -88,6 +120,31 @@ if not api_key:
     st.warning("👈 请先在左侧输入 API Key 启动系统")
     st.stop()
 
+# ==========================================
+# 纪要：后台滚动更新，点击时直接取用
+# ==========================================
+def generate_report(session_id, editor, history, polish=False):
+    """
+    返回当前纪要：已有滚动纪要时直接读库 (polish 时基于纪要和未整理的新消息润色一遍)；
+    还没有纪要时 (会话较短) 从完整记录生成。生成出错时显示错误并返回 None
+    """
+    minutes = get_minutes(session_id)
+    if minutes is None or polish:
+        context = history if minutes is None else minutes_context(minutes, pending_messages(session_id, minutes))
+        try:
+            return st.write_stream(editor.summarize_stream(context))
+        except Exception as e:
+            # 中途出错：已上屏的半截报告不保存、不提供下载
+            st.error(f"❌ 生成报告失败: {str(e)}")
+            return None
+    # 这里只显示条数，不需要解压长消息的正文
+    pending = pending_messages(session_id, minutes, with_body=False)
+    report = minutes["minutes"]
+    st.markdown(report)
+    if pending:
+        st.caption(f"🕒 纪要已整理至第 {minutes['message_count']} 条消息，另有 {len(pending)} 条新消息将在后台并入")
+    return report
+
 # ==========================================
 # 视图 A: 创建新会话
 # ==========================================
@@ -217,46 +274,39 @@ def render_chat_view(session_id, title):
             final_prompt = f"【背景资料】\n{pdf_content}\n\n【问题】{user_input}"
         
         with st.chat_message("assistant"):
-            with st.spinner("思考中..."):
-                response = agent.chat(final_prompt, image_base64)
-                st.write(response)
-        add_message(session_id, "assistant", response)
+            # 流式输出：边生成边上屏
+            try:
+                response = st.write_stream(agent.chat_stream(final_prompt, image_base64))
+            except Exception as e:
+                # 中途出错：已上屏的半截回复不入库，错误单独显示
+                response = None
+                st.error(f"❌ 接口调用失败: {str(e)}")
+            if response is not None and agent.last_ttft is not None:
+                st.caption(f"⏱️ 首字 {agent.last_ttft:.2f}s · 总耗时 {agent.last_latency:.2f}s")
+        if response is not None:
+            add_message(session_id, "assistant", response)
+
+    # 新消息攒够一批就在后台并入纪要
+    schedule_minutes_update(api_key, base_url, model_name, session_id)
 
     st.divider()
     
     with st.expander("📝 导出对话纪要", expanded=False):
+        polish = st.checkbox("✨ 润色后输出", help="基于已整理的纪要再润色一遍，稍慢")
         if st.button("生成总结报告"):
             if len(agent.history) <= 1:
                 st.warning("暂无讨论记录")
             else:
                 with st.spinner("✍️ 正在整理对话记录，生成纪要..."):
-                    history_lines = []
-                    for m in agent.history:
-                        role = m["role"]
-                        content = m["content"]
-                        text_content = ""
-                        if isinstance(content, list):
-                            for item in content:
-                                if item["type"] == "text":
-                                    text_content += item["text"]
-                                elif item["type"] == "image_url":
-                                    text_content += "[图片]"
-                        else:
-                            text_content = str(content)
-                        history_lines.append(f"{role}: {text_content}")
-                    
-                    full_context = "\n".join(history_lines)
-                    report = agent.summarize(full_context)
-                    
                     st.markdown("### 📝 对话纪要")
-                    st.markdown(report)
-                    
-                    st.download_button(
-                        label="📥 下载 Markdown 文件",
-                        data=report,
-                        file_name=f"{title}_report.md",
-                        mime="text/markdown"
-                    )
+                    report = generate_report(session_id, agent, agent.history, polish)
+                    if report:
+                        st.download_button(
+                            label="📥 下载 Markdown 文件",
+                            data=report,
+                            file_name=f"{title}_report.md",
+                            mime="text/markdown"
+                        )
 
 # ==========================================
 # 视图 C: 聚焦式对话模式 (Focus Mode)
@@ -264,11 +314,19 @@ def render_chat_view(session_id, title):
 def render_focus_view(session_id, title):
     st.title(f"🎯 {title}")
     
-    # 初始化 Session State
-    if "focus_session" not in st.session_state:
-        st.session_state.focus_session = FocusSession(api_key=api_key, base_url=base_url, model=model_name)
-    
-    focus_agent = st.session_state.focus_session
+    # 每个会话一个 FocusSession，首次打开时从数据库恢复共识集与对话历史
+    if "focus_sessions" not in st.session_state:
+        st.session_state.focus_sessions = {}
+    focus_agent = st.session_state.focus_sessions.get(session_id)
+    if focus_agent is None:
+        state = load_focus_state(session_id)
+        if state is not None:
+            focus_agent = FocusSession.from_state(state, api_key=api_key, base_url=base_url, model=model_name, session_id=session_id)
+        else:
+            focus_agent = FocusSession(api_key=api_key, base_url=base_url, model=model_name, topic=title, session_id=session_id)
+        st.session_state.focus_sessions[session_id] = focus_agent
+    # 侧边栏配置可能改过
+    focus_agent.api_key, focus_agent.base_url, focus_agent.model = api_key, base_url, model_name
     
     # 显示历史记录
     history = get_messages(session_id)
@@ -298,6 +356,8 @@ def render_focus_view(session_id, title):
         # 2. 处理流程
         with st.chat_message("assistant"):
             status_placeholder = st.empty()
+            response_placeholder = st.empty()
+            streamed = []
             
             # 定义回调函数来更新 UI
             def update_progress(insights):
@@ -305,25 +365,37 @@ def render_focus_view(session_id, title):
                     with st.expander("🧠 正在进行后台全量思维发散...", expanded=True):
                         for note in insights:
                             st.markdown(f"**Thinking on Chunk {note['id']}**: {note['note']}")
+
+            # 回复边生成边显示
+            def update_response(delta):
+                streamed.append(delta)
+                response_placeholder.markdown("".join(streamed) + "▌")
             
             with st.spinner("👂 正在监听并拆解语义块..."):
                 # 运行异步任务
                 # 注意：Streamlit 中运行 asyncio.run 可能有 event loop 问题
                 # 简单的处理方式是创建一个新的 loop 或者使用 asyncio.run (如果当前不在 loop 中)
                 try:
-                    result = asyncio.run(focus_agent.process_full_input(user_input, progress_callback=update_progress))
+                    result = asyncio.run(focus_agent.process_full_input(user_input, progress_callback=update_progress, response_callback=update_response, deadline=THINK_DEADLINE_SECONDS))
                 except RuntimeError:
                     # 如果已经在 loop 中 (比如某些 streamlit 部署环境)，则使用 create_task 或 await
                     # 但在这里 standard streamlit run 是同步的，可以直接 run
                     loop = asyncio.new_event_loop()
                     asyncio.set_event_loop(loop)
-                    result = loop.run_until_complete(focus_agent.process_full_input(user_input, progress_callback=update_progress))
+                    result = loop.run_until_complete(focus_agent.process_full_input(user_input, progress_callback=update_progress, response_callback=update_response, deadline=THINK_DEADLINE_SECONDS))
                     loop.close()
 
+            response_placeholder.empty()
+
             # 3. 结果展示
             # A. 展示 Insights
             insights = result["insights"]
-            with st.expander("🧠 思维发散完成 (点击查看所有后台笔记)", expanded=False):
+            expander_title = "🧠 思维发散完成 (点击查看所有后台笔记)"
+            if result.get("reused_chunks"):
+                expander_title += f" · 复用 {result['reused_chunks']}/{result['chunks_count']} 个片段的笔记"
+            if result.get("skipped_chunks"):
+                expander_title += f" · {result['skipped_chunks']} 个片段超时未纳入"
+            with st.expander(expander_title, expanded=False):
                 for note in insights:
                     st.markdown(f"**片段 {note['id']}**: {note['chunk'][:50]}...")
                     st.info(f"💡 {note['note']}")
@@ -338,7 +410,13 @@ def render_focus_view(session_id, title):
             # C. 展示最终回复
             st.markdown("### 💬 回应")
             st.write(result["response"])
-            
+            timings = result.get("timings", {})
+            st.caption(
+                f"⏱️ 总计 {timings.get('total', 0):.1f}s · 思考 {timings.get('think', 0):.1f}s · "
+                f"选择 {timings.get('select', 0):.1f}s · 回应 {timings.get('speak', 0):.1f}s · "
+                f"等待上轮共识 {timings.get('consensus_wait', 0):.1f}s · 并发上限 {result['concurrency']['limit']}"
+            )
+
             # 保存回复
             add_message(session_id, "assistant", result["response"])
 
@@ -352,34 +430,30 @@ def render_meeting_view(session_id, title):
         mc = MeetingController(api_key=api_key, base_url=base_url, model=model_name)
         mc.topic = title
         
-        db_messages = get_messages(session_id)
         agents_loaded = False
         
-        for msg in db_messages:
-            if msg["role"] == "system_agents_config":
-                try:
-                    config = json.loads(msg["content"])
-                    for agent_conf in config:
-                        mc.add_agent(ResearchAgent(
-                            name=agent_conf["name"], 
-                            system_prompt=agent_conf["prompt"], 
-                            model=model_name, 
-                            api_key=api_key, 
-                            base_url=base_url
-                        ))
-                    agents_loaded = True
-                    break
-                except:
-                    pass
+        # 专家配置只读第一条 system_agents_config，不用把整段会议记录读出来再筛
+        for msg in iter_messages(session_id, limit=1, roles=["system_agents_config"]):
+            try:
+                config = json.loads(msg["content"])
+                for agent_conf in config:
+                    mc.add_agent(ResearchAgent(
+                        name=agent_conf["name"], 
+                        system_prompt=agent_conf["prompt"], 
+                        model=model_name, 
+                        api_key=api_key, 
+                        base_url=base_url
+                    ))
+                agents_loaded = True
+            except:
+                pass
         
         if not agents_loaded:
             mc.add_agent(ResearchAgent(name="AI信仰者", system_prompt="激进的AI信仰者", model=model_name, api_key=api_key, base_url=base_url))
             mc.add_agent(ResearchAgent(name="认知科学家", system_prompt="保守的实证主义者", model=model_name, api_key=api_key, base_url=base_url))
             mc.add_agent(ResearchAgent(name="伦理学家", system_prompt="关注社会影响", model=model_name, api_key=api_key, base_url=base_url))
 
-        for msg in db_messages:
-            if msg["role"] != "system_agents_config":
-                mc.history.append(msg)
+        mc.history.extend(get_messages(session_id, exclude_roles=["system_agents_config"]))
                 
         if not mc.history:
             welcome = f"大家好，今天的议题是：{title}。"
@@ -399,26 +473,72 @@ def render_meeting_view(session_id, title):
     # 我们把“下一位发言”和“导出”放在输入框上方，避免布局冲突
     col1, col2 = st.columns([1, 1])
     with col1:
-        if st.button("🗣️ 让下一位专家发言", type="primary", use_container_width=True):
+        if mc.pending_openers():
+            # 开场发言互不依赖，所有还没发言的专家同时开场
+            if st.button("🎤 全体专家开场", type="primary", use_container_width=True):
+                def show_opening(msg):
+                    # 每位专家一开完场就入库、上屏，不等其他人
+                    add_message(session_id, msg["role"], msg["content"])
+                    with st.chat_message(msg["role"]):
+                        st.write(msg["content"])
+
+                with st.spinner("专家们正在准备开场发言..."):
+                    mc.run_opening_round(on_message=show_opening)
+                st.rerun()
+        elif st.button("🗣️ 让下一位专家发言", type="primary", use_container_width=True):
             with st.spinner("主持人正在点名..."):
                 msg = mc.step()
                 add_message(session_id, msg["role"], msg["content"])
                 st.rerun()
     
     with col2:
-        # 简化版导出：直接生成，不再折叠，方便随时看
+        # 简化版导出：直接取后台维护的滚动纪要，不再折叠，方便随时看
         if st.button("📝 生成/更新 会议纪要", use_container_width=True):
             if not mc.history:
                 st.warning("暂无记录")
             else:
-                with st.spinner("正在生成报告..."):
-                    full_context = "\n".join([f"{m['role']}: {m['content']}" for m in mc.history])
-                    editor = ResearchAgent("编辑", "编辑", model_name, api_key, base_url)
-                    report = editor.summarize(full_context)
-                    # 存入 Session State 防止刷新消失
+                editor = ResearchAgent("编辑", "编辑", model_name, api_key, base_url)
+                # 生成结果存入 Session State 防止刷新消失
+                report = generate_report(session_id, editor, mc.history, st.session_state.get("polish_minutes", False))
+                if report:
                     st.session_state.last_report = report
                     st.rerun()
 
+    # 自动推进：后台连续跑若干轮，每条发言一完成就上屏并入库
+    auto_col1, auto_col2 = st.columns([1, 1])
+    with auto_col1:
+        auto_rounds = st.number_input("自动推进轮数", min_value=1, max_value=5, value=1, label_visibility="collapsed")
+    with auto_col2:
+        if st.button(f"⏩ 自动推进 {auto_rounds} 轮", use_container_width=True):
+            with st.spinner("会议自动进行中..."):
+                for msg in mc.run_autopilot(
+                    rounds=int(auto_rounds),
+                    on_message=lambda m: add_message(session_id, m["role"], m["content"])
+                ):
+                    with st.chat_message(msg["role"]):
+                        st.write(msg["content"])
+            st.rerun()
+
+    st.checkbox("✨ 纪要润色后输出", key="polish_minutes", help="基于已整理的纪要再润色一遍，稍慢")
+    # 每次有新发言 (点名 / 自动推进 / 插话都会 rerun) 后检查一次，攒够一批就在后台并入纪要
+    schedule_minutes_update(api_key, base_url, model_name, session_id)
+
+    stats = mc.selection_stats
+    total_selections = sum(stats.values())
+    if total_selections:
+        st.caption(f"🧭 点名 {total_selections} 次，其中 {total_selections - stats['llm']} 次由本地规则决定")
+
+    # 推测执行：用户阅读时后台预生成下一位专家的发言，点击即出
+    speculative = st.toggle("⚡ 预生成下一位发言", value=mc.speculative, help="趁你阅读时提前生成；插话会让预生成作废，浪费过多或命中率低时自动停止")
+    if speculative != mc.speculative:
+        mc.set_speculative(speculative)
+    spec_stats = mc.speculation_stats
+    if spec_stats["started"]:
+        st.caption(
+            f"⚡ 预生成 {spec_stats['started']} 次 · 命中 {spec_stats['hits']} · 作废 {spec_stats['misses']} · "
+            f"命中率 {mc.speculation_hit_rate():.0%} · 浪费约 {spec_stats['wasted_tokens']} token"
+        )
+
     # 显示生成的报告（如果有）
     if "last_report" in st.session_state and st.session_state.last_report:
         with st.expander("📄 当前会议纪要 (点击展开)", expanded=True):
@@ -430,7 +550,7 @@ def render_meeting_view(session_id, title):
     if user_input := st.chat_input("在此输入你的观点，或向专家提问..."):
         # 用户发言直接上屏
         add_message(session_id, "user", user_input)
-        mc.history.append({"role": "user", "content": user_input})
+        mc.interject(user_input)
         st.rerun()
 
 # --- 4. 主路由逻辑 ---
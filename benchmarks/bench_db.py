@@ -0,0 +1,111 @@
+# benchmarks/bench_db.py
+"""
+数据库连接层基准测试：对比「每次操作都 connect/close」和「线程复用 + WAL」两种方式
+
+用法: python benchmarks/bench_db.py [--ops 2000] [--threads 4]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from init_db import init_db
+from utils import db_utils
+
+
+# --- 旧实现：每个操作单独开关连接 ---
+
+def legacy_add_message(db_path, session_id, role, content):
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute(
+        "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+        (session_id, role, str(content))
+    )
+    conn.commit()
+    conn.close()
+
+def legacy_get_messages(db_path, session_id):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute("SELECT role, content FROM messages WHERE session_id = ? ORDER BY id ASC", (session_id,))
+    messages = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return messages
+
+
+def run_threads(n_threads, ops, fn):
+    """n_threads 个线程并发执行 fn(i)，返回总 ops/sec"""
+    def worker():
+        for i in range(ops):
+            fn(i)
+
+    threads = [threading.Thread(target=worker) for _ in range(n_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return n_threads * ops / elapsed
+
+
+def bench(label, db_path, n_threads, ops, add_fn, get_fn):
+    session_id = "bench-session"
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO sessions (session_id, title, session_type) VALUES (?, 'bench', 'chat')", (session_id,))
+    conn.commit()
+    conn.close()
+    write_rate = run_threads(n_threads, ops, lambda i: add_fn(session_id, "user", f"消息 {i}"))
+    # 读操作：一次页面刷新通常就是取最近一段对话
+    read_rate = run_threads(n_threads, ops // 10 or 1, lambda i: get_fn(session_id))
+    print(f"{label:<14} 写入 {write_rate:10.0f} ops/s   读取 {read_rate:10.0f} ops/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=2000, help="每个线程的写操作次数")
+    parser.add_argument("--threads", type=int, default=4, help="并发线程数 (模拟多个用户)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        pooled_path = os.path.join(tmp, "pooled.db")
+        init_db(legacy_path)
+        init_db(pooled_path)
+
+        print(f"线程数={args.threads} 每线程写入={args.ops}")
+        bench(
+            "before", legacy_path, args.threads, args.ops,
+            lambda s, r, c: legacy_add_message(legacy_path, s, r, c),
+            lambda s: legacy_get_messages(legacy_path, s),
+        )
+
+        db_utils.DB_PATH = pooled_path
+        bench(
+            "after", pooled_path, args.threads, args.ops,
+            db_utils.add_message,
+            db_utils.get_messages,
+        )
+
+        # 写后缓冲：add_message 只入队，读之前 flush (计入读取耗时)
+        db_utils.DB_PATH = os.path.join(tmp, "write_behind.db")
+        init_db(db_utils.DB_PATH)
+        db_utils.enable_write_behind()
+        bench(
+            "write-behind", db_utils.DB_PATH, args.threads, args.ops,
+            db_utils.add_message,
+            db_utils.get_messages,
+        )
+        db_utils.flush()
+        db_utils.close_db_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# benchmarks/bench_indexes.py
+"""
+热点查询索引基准测试：在合成数据库上对比迁移前 (v1，无索引) 和迁移后 (最新版本) 的查询计划与耗时
+
+用法: python benchmarks/bench_indexes.py [--messages 1000000] [--sessions 5000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.db_migrations import migrate
+
+QUERIES = {
+    "get_messages": ("SELECT role, content FROM messages WHERE session_id = ? ORDER BY id ASC", True),
+    "get_all_sessions": ("SELECT * FROM sessions ORDER BY created_at DESC", False),
+}
+
+
+def build_db(path, n_sessions, n_messages):
+    conn = sqlite3.connect(path)
+    migrate(conn, target=1)
+    session_ids = [f"session-{i:06d}" for i in range(n_sessions)]
+    conn.executemany(
+        "INSERT INTO sessions (session_id, title, session_type, created_at) VALUES (?, ?, 'chat', datetime('now', ?))",
+        [(sid, f"会话 {i}", f"-{i} minutes") for i, sid in enumerate(session_ids)]
+    )
+    rng = random.Random(0)
+    batch = []
+    for i in range(n_messages):
+        batch.append((rng.choice(session_ids), "user" if i % 2 else "assistant", f"第 {i} 条消息的内容"))
+        if len(batch) >= 50000:
+            conn.executemany("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", batch)
+    conn.commit()
+    return conn, session_ids
+
+
+def report(conn, session_ids, repeat):
+    rng = random.Random(1)
+    for name, (sql, per_session) in QUERIES.items():
+        params = (session_ids[0],) if per_session else ()
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        print(f"  [{name}] 查询计划:")
+        for row in plan:
+            print(f"      {row[-1]}")
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            params = (rng.choice(session_ids),) if per_session else ()
+            conn.execute(sql, params).fetchall()
+        avg_ms = (time.perf_counter() - start) / repeat * 1000
+        print(f"  [{name}] 平均耗时: {avg_ms:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        start = time.perf_counter()
+        conn, session_ids = build_db(path, args.sessions, args.messages)
+        print(f"生成 {args.sessions} 个会话 / {args.messages} 条消息，用时 {time.perf_counter() - start:.1f}s")
+
+        print("迁移前 (v1):")
+        report(conn, session_ids, args.repeat)
+
+        start = time.perf_counter()
+        version = migrate(conn)
+        print(f"原地升级到 v{version}，用时 {time.perf_counter() - start:.1f}s")
+
+        print(f"迁移后 (v{version}):")
+        report(conn, session_ids, args.repeat)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# benchmarks/bench_search.py
+"""
+全文检索基准测试：在合成数据库上测量 search_messages / search_sessions 的查询耗时
+
+用法: python benchmarks/bench_search.py [--messages 1000000] [--sessions 5000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import db_utils
+from utils.db_migrations import migrate
+
+WORDS = [
+    "大语言模型", "注意力机制", "强化学习", "实验数据", "认知科学", "伦理风险", "神经网络", "因果推断",
+    "样本效率", "泛化能力", "对齐", "幻觉", "推理", "基准测试", "消融实验", "数据集", "损失函数",
+    "transformer", "diffusion", "benchmark", "scaling law", "的", "是", "我们", "认为", "但是", "可能",
+]
+
+QUERIES = ["注意力机制", "因果推断 数据集", "模型", "scaling", "罕见术语", "不存在的词语组合"]
+
+
+def build_db(path, n_sessions, n_messages):
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    rng = random.Random(0)
+    session_ids = [f"session-{i:06d}" for i in range(n_sessions)]
+    conn.executemany(
+        "INSERT INTO sessions (session_id, title, session_type) VALUES (?, ?, 'chat')",
+        [(sid, "关于" + "".join(rng.sample(WORDS, 2)) + "的讨论") for sid in session_ids]
+    )
+    batch = []
+    for i in range(n_messages):
+        content = "".join(rng.choice(WORDS) for _ in range(rng.randint(8, 40)))
+        if i % 5000 == 0:
+            content += "罕见术语"  # 低频词：走相关度排序分支
+        batch.append((rng.choice(session_ids), "user" if i % 2 else "assistant", content))
+        if len(batch) >= 50000:
+            conn.executemany("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        start = time.perf_counter()
+        build_db(path, args.sessions, args.messages)
+        print(f"生成 {args.sessions} 个会话 / {args.messages} 条消息 (含索引)，用时 {time.perf_counter() - start:.1f}s")
+
+        db_utils.DB_PATH = path
+        for query in QUERIES:
+            for label, fn in (("search_messages", db_utils.search_messages), ("search_sessions", db_utils.search_sessions)):
+                fn(query, 20)  # 预热页缓存
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    hits = fn(query, 20)
+                avg_ms = (time.perf_counter() - start) / args.repeat * 1000
+                print(f"{label:<16} {query!r:<20} {len(hits):>3} 条结果  {avg_ms:8.2f} ms")
+        db_utils.close_db_connection()
+
+
+if __name__ == "__main__":
+    main()
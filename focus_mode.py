@@ -1,56 +1,140 @@
 import asyncio
+import heapq
 import re
 import json
-from typing import List, Dict
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Dict, Optional
 from openai import AsyncOpenAI
+from utils.chunker import CHUNK_MAX_TOKENS, iter_chunks
+from utils.concurrency import AdaptiveLimiter, get_concurrency_limiter
+from utils.db_utils import save_focus_state
+from utils.similarity import NearDuplicateIndex
+from utils.llm_client import get_async_client
+from utils.llm_utils import acached_completion, achat_completion, astream_chat_completion
+
+# 共识分析在后台事件循环里跑，不阻塞回复；界面每轮 asyncio.run 的循环结束后它仍能继续
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_lock = threading.Lock()
+
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, name="focus-consensus", daemon=True).start()
+        return _background_loop
+
+
+# 本地打分后进入 LLM 最终确认的候选笔记数
+SHORTLIST_SIZE = 6
+# 界面上思考阶段的默认截止时间 (秒)，长文中最慢的几个片段不再拖住整轮回复
+THINK_DEADLINE_SECONDS = 45.0
+# 持久化时保留的最近对话轮数 (共识分析只用最近 3 轮)
+STATE_HISTORY_TURNS = 10
+STATE_VERSION = 1
+# 提示词里最多带多少条共识 (各取最近的)
+CONSENSUS_PROMPT_LIMIT = 8
+# 待确认共识最多保留多少条，超出时丢弃最早的
+PENDING_CONSENSUS_MAX = 30
+
+
+def _bigrams(text: str) -> set:
+    text = re.sub(r"\s+", "", text.lower())
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
 
 class FocusSession:
-    def __init__(self, api_key: str, base_url: str = None, model: str = "gpt-3.5-turbo", topic: str = ""):
+    def __init__(self, api_key: str, base_url: str = None, model: str = "gpt-3.5-turbo", topic: str = "",
+                 session_id: Optional[str] = None):
         self.api_key = api_key
         self.base_url = base_url
         self.model = model
         self.topic = topic
-        
-        if base_url:
-            self.client = AsyncOpenAI(api_key=api_key, base_url=base_url)
-        else:
-            self.client = AsyncOpenAI(api_key=api_key)
+        # 设置后每轮结束、每次共识合并后都会把状态存进数据库
+        self.session_id = session_id
+        self._save_lock = threading.Lock()
             
         self.insight_notes = []
+        self._shortlist = []  # 本地打分最高的候选笔记 (小顶堆: (分数, -id, 笔记)，同分保留靠前的片段)
         self.full_input_buffer = ""
         # 共识集数据结构
         self.confirmed_consensus = []  # 已确认共识
         self.pending_consensus = []    # 待确认共识
         self.conversation_history = [] # 对话历史记录
+        # 后台共识分析：下一轮开始前必须等它合并完
+        self._consensus_future: Optional[Future] = None
+        self._consensus_lock = threading.Lock()
+        self.last_consensus_result = {"confirmed": [], "new_pending": []}
+        self.last_consensus_seconds = 0.0
+        # 共识近重复索引，键为 ("confirmed" | "pending", 原文)
+        self._consensus_index = NearDuplicateIndex()
+
+    def to_state(self) -> Dict:
+        """导出需要跨轮保留的状态 (不含 API Key 等配置)"""
+        with self._consensus_lock:
+            return {
+                "version": STATE_VERSION,
+                "topic": self.topic,
+                "confirmed_consensus": list(self.confirmed_consensus),
+                "pending_consensus": list(self.pending_consensus),
+                "conversation_history": self.conversation_history[-STATE_HISTORY_TURNS:],
+                "last_consensus_result": self.last_consensus_result,
+            }
+
+    @classmethod
+    def from_state(cls, state: Dict, api_key: str, base_url: str = None, model: str = "gpt-3.5-turbo",
+                   session_id: Optional[str] = None) -> "FocusSession":
+        """用 to_state 导出的状态恢复会话"""
+        session = cls(api_key=api_key, base_url=base_url, model=model, topic=state.get("topic", ""),
+                      session_id=session_id)
+        session.confirmed_consensus = list(state.get("confirmed_consensus", []))
+        session.pending_consensus = list(state.get("pending_consensus", []))
+        session.conversation_history = list(state.get("conversation_history", []))
+        session.last_consensus_result = state.get("last_consensus_result", session.last_consensus_result)
+        for consensus in session.confirmed_consensus:
+            session._consensus_index.add(("confirmed", consensus), consensus)
+        for pending in session.pending_consensus:
+            session._consensus_index.add(("pending", pending), pending)
+        return session
 
-    def _chunk_text(self, text: str, max_length: int = 300) -> List[str]:
+    def save_state(self):
+        """把当前状态写入数据库 (未绑定 session_id 时不做任何事)"""
+        if self.session_id is None:
+            return
+        # 快照和写入放在同一把锁里，保证后写入的总是更新的快照
+        with self._save_lock:
+            try:
+                save_focus_state(self.session_id, self.to_state())
+            except Exception as e:
+                print(f"保存聚焦会话状态失败: {e}")
+
+    @property
+    def client(self) -> AsyncOpenAI:
         """
-        语义分块：根据标点符号或长度切分
-        增加分块粒度，避免过细切分。只有当长度超过 max_length 且遇到结束标点时才切分。
+        当前事件循环下共享的异步客户端
+        AsyncOpenAI 的连接池绑定在事件循环上，而界面每轮都会 asyncio.run 一个新循环
         """
-        # 简单按标点切分
-        # keep delimiters
-        parts = re.split(r'([。！？\n])', text)
-        chunks = []
-        current_chunk = ""
-        
-        for part in parts:
-            current_chunk += part
-            # 只有当当前块长度超过阈值，且遇到了句子结束符，才进行切分
-            # 这样可以保证一个 chunk 包含完整的句子，且有足够的上下文
-            if len(current_chunk) >= max_length and part in ['。', '！', '？', '\n']:
-                if current_chunk.strip():
-                    chunks.append(current_chunk.strip())
-                current_chunk = ""
-        
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
-            
-        return chunks
+        return get_async_client(self.api_key, self.base_url)
+
+    @property
+    def limiter(self) -> AdaptiveLimiter:
+        """后台思考的并发限制器，同一服务商 / 模型的所有聚焦会话共用"""
+        return get_concurrency_limiter(self.base_url, self.model)
+
+    def _chunk_text(self, text: str, max_length: int = CHUNK_MAX_TOKENS) -> List[str]:
+        """
+        语义分块：按句子边界切分，每块不超过 max_length 个 token
+        (保留原接口，内部使用流式分块器 iter_chunks)
+        """
+        return list(iter_chunks(text, max_tokens=max_length, stable_boundaries=True))
 
     async def _think_background(self, chunk: str, chunk_id: int):
         """
         后台思考者：针对片段进行联想发散
+        同一片段 (同主题、同模型) 之前想过的，直接复用缓存的笔记
         """
         prompt = f"""你是一个敏锐的记录员。对方正在汇报片段：'{chunk}'。
 当前讨论的主题是：【{self.topic}】。
@@ -63,27 +147,68 @@ class FocusSession:
    原文点：<简要概括原文核心点>
    我的思考：<你的联想、疑问或延伸，尽量与主题 '{self.topic}' 挂钩>"""
         
+        messages = [{"role": "user", "content": prompt}]
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            content = response.choices[0].message.content
+            # 片段和主题都没变时直接复用上次的笔记 (大模型响应缓存)，不用排队
+            cached = await acached_completion(self.client, self.model, messages)
+            if cached is not None:
+                note = cached.strip()
+                self._add_note({"id": chunk_id, "chunk": chunk, "note": note, "reused": True})
+                return note
+
+            # 按会话公平排队，并发上限随延迟和错误率自动调整
+            async with self.limiter.slot(owner=id(self)):
+                content = await achat_completion(self.client, self.model, messages)
             # 简单清理一下
             note = content.strip()
-            self.insight_notes.append({"id": chunk_id, "chunk": chunk, "note": note})
+            self._add_note({"id": chunk_id, "chunk": chunk, "note": note})
             return note
         except Exception as e:
             return f"Thinking failed: {e}"
 
+    def _score_note(self, note: Dict) -> float:
+        """
+        本地快速打分 (不调用大模型)，用于边收笔记边维护候选名单
+        对方明确提出问题的片段优先，其次看笔记与主题的字面重合度
+        """
+        score = 0.0
+        if "？" in note["chunk"] or "?" in note["chunk"]:
+            score += 2.0
+        topic_grams = _bigrams(self.topic)
+        if topic_grams:
+            score += 3.0 * len(topic_grams & _bigrams(note["note"])) / len(topic_grams)
+        thought = note["note"].split("我的思考", 1)[-1]
+        if "？" in thought or "?" in thought:
+            score += 0.5
+        if len(thought.strip("：: \n")) < 8:
+            # 几乎没有发散内容
+            score -= 1.0
+        return score
+
+    def _add_note(self, note: Dict):
+        """记录一条笔记，并更新候选名单"""
+        note["score"] = self._score_note(note)
+        self.insight_notes.append(note)
+        heapq.heappush(self._shortlist, (note["score"], -note["id"], note))
+        if len(self._shortlist) > SHORTLIST_SIZE:
+            heapq.heappop(self._shortlist)
+
+    def _shortlist_notes(self) -> List[Dict]:
+        """候选名单，按分数从高到低 (同分按片段顺序)"""
+        return [n for _, _, n in sorted(self._shortlist, key=lambda x: (-x[0], -x[1]))]
+
     async def _select_best_insight(self) -> str:
         """
-        聚焦选择器：选出 1-3 个最有价值的切入点
+        聚焦选择器：从本地打分的候选名单中选出 1-3 个最有价值的切入点
+        只有候选名单交给大模型确认，提示词长度不随输入长度增长
         """
-        if not self.insight_notes:
+        candidates = self._shortlist_notes()
+        if not candidates:
             return "无"
+        if len(candidates) == 1:
+            return f"【切入点 {candidates[0]['id']}】: {candidates[0]['note']}"
             
-        all_notes_str = "\n".join([f"ID {n['id']}: {n['note']}" for n in self.insight_notes])
+        all_notes_str = "\n".join([f"ID {n['id']}: {n['note']}" for n in candidates])
         
         prompt = f"""回顾后台记录的笔记：
 {all_notes_str}
@@ -97,25 +222,25 @@ class FocusSession:
 4. 返回格式：请直接返回被选中点的【ID数字列表】，例如：[1, 3, 5]，不要返回其他文字。"""
 
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            selection = response.choices[0].message.content.strip()
+            selection = (await achat_completion(
+                self.client,
+                self.model,
+                [{"role": "user", "content": prompt}]
+            )).strip()
             
             # 提取所有数字 ID
             selected_ids = [int(i) for i in re.findall(r'\d+', selection)]
             
             selected_notes = []
-            for note in self.insight_notes:
+            for note in candidates:
                 if note['id'] in selected_ids:
                     selected_notes.append(f"【切入点 {note['id']}】: {note['note']}")
             
             if selected_notes:
                 return "\n\n".join(selected_notes)
             
-            # Fallback
-            return self.insight_notes[-1]['note']
+            # Fallback: 本地打分最高的一条
+            return candidates[0]['note']
         except Exception as e:
             return f"Selection failed: {e}"
 
@@ -129,6 +254,7 @@ class FocusSession:
         for i, turn in enumerate(recent_history, 1):
             history_str += f"第{i}轮:\n用户: {turn['user'][:100]}...\nAI: {turn['ai'][:100]}...\n\n"
         
+        confirmed_consensus, pending_consensus = self._consensus_for_prompt()
         prompt = f"""分析以下对话内容，判断共识达成情况：
 
 当前轮对话：
@@ -138,8 +264,8 @@ AI 回应：{ai_response}
 最近对话历史：
 {history_str}
 
-当前已确认共识：{self.confirmed_consensus}
-当前待确认共识：{self.pending_consensus}
+当前已确认共识：{confirmed_consensus}
+当前待确认共识：{pending_consensus}
 
 任务：
 1. 检查待确认共识中是否有可以转化为已确认共识的内容
@@ -155,12 +281,12 @@ AI 回应：{ai_response}
 注意：共识应该是双方都明确认可的观点或事实，要有充分的证据支持。"""
         
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
+            result = await achat_completion(
+                self.client,
+                self.model,
+                [{"role": "user", "content": prompt}],
                 response_format={"type": "json_object"}
             )
-            result = response.choices[0].message.content
             consensus_data = json.loads(result)
             
             # 验证和清理共识数据
@@ -188,15 +314,84 @@ AI 回应：{ai_response}
             print(f"共识分析错误: {e}")
             return {"confirmed": [], "new_pending": []}
 
-    async def _speak_response(self, selected_point: str) -> str:
+    def _merge_consensus(self, consensus_result: Dict):
+        """
+        把一次共识分析的结果合并进共识集
+        大模型经常换个说法重复同一条共识，这里按近重复判断，而不是逐字比较
+        """
+        with self._consensus_lock:
+            index = self._consensus_index
+            for consensus in consensus_result.get("confirmed", []):
+                match = index.find(consensus)
+                if match is not None and match[0] == "confirmed":
+                    continue
+                # 待确认共识被确认：从待确认中移除 (原文可能是另一种说法)
+                if match is not None and match[0] == "pending":
+                    self.pending_consensus.remove(match[1])
+                    index.remove(match)
+                self.confirmed_consensus.append(consensus)
+                index.add(("confirmed", consensus), consensus)
+
+            # 添加新的待确认共识 (和已有的任一共识重复都跳过)
+            for new_pending in consensus_result.get("new_pending", []):
+                if index.find(new_pending) is not None:
+                    continue
+                self.pending_consensus.append(new_pending)
+                index.add(("pending", new_pending), new_pending)
+
+            while len(self.pending_consensus) > PENDING_CONSENSUS_MAX:
+                index.remove(("pending", self.pending_consensus.pop(0)))
+            self.last_consensus_result = consensus_result
+
+    def _consensus_for_prompt(self):
+        """提示词里使用的共识集 (各取最近 CONSENSUS_PROMPT_LIMIT 条)"""
+        with self._consensus_lock:
+            return self.confirmed_consensus[-CONSENSUS_PROMPT_LIMIT:], self.pending_consensus[-CONSENSUS_PROMPT_LIMIT:]
+
+    async def _consensus_job(self, user_input: str, ai_response: str) -> Dict:
+        start = time.perf_counter()
+        consensus_result = await self._analyze_consensus(user_input, ai_response)
+        self._merge_consensus(consensus_result)
+        self.last_consensus_seconds = time.perf_counter() - start
+        self.save_state()
+        return consensus_result
+
+    def _start_consensus(self, user_input: str, ai_response: str):
+        """在后台事件循环中启动共识分析"""
+        self._consensus_future = asyncio.run_coroutine_threadsafe(
+            self._consensus_job(user_input, ai_response), _get_background_loop()
+        )
+
+    async def _await_consensus(self):
+        """等上一轮的共识分析合并完成 (保证本轮看到的是最新共识集)"""
+        future = self._consensus_future
+        if future is not None:
+            try:
+                await asyncio.wrap_future(future)
+            except Exception as e:
+                print(f"共识分析错误: {e}")
+
+    def wait_for_consensus(self, timeout: Optional[float] = None) -> Dict:
+        """同步等待后台共识分析完成，返回最近一次的分析结果"""
+        future = self._consensus_future
+        if future is not None:
+            try:
+                future.result(timeout)
+            except Exception as e:
+                print(f"共识分析错误: {e}")
+        return self.last_consensus_result
+
+    async def _speak_response(self, selected_point: str, response_callback=None) -> str:
         """
         表达生成器：生成简短回复
+        :param response_callback: 传入时流式生成，每收到一段文本调用一次 response_callback(片段)
         """
+        confirmed_consensus, pending_consensus = self._consensus_for_prompt()
         prompt = f"""对方刚称述完它的观点。你需要和他对话和探讨。
 当前讨论的主题是：【{self.topic}】。
 
-当前已确认共识：{self.confirmed_consensus}
-当前待确认共识：{self.pending_consensus}
+当前已确认共识：{confirmed_consensus}
+当前待确认共识：{pending_consensus}
 
 任务：基于以下选中的切入点进行回复（注意：切入点中包含了【原文点】和【我的思考】）：
 {selected_point}
@@ -212,66 +407,104 @@ AI 回应：{ai_response}
 7. 一般篇幅在50-100字左右，最长篇幅不要超过200字，可长可短。"""
 
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response.choices[0].message.content
+            if response_callback is None:
+                return await achat_completion(
+                    self.client,
+                    self.model,
+                    [{"role": "user", "content": prompt}]
+                )
+            parts = []
+            async for delta in astream_chat_completion(
+                self.client,
+                self.model,
+                [{"role": "user", "content": prompt}]
+            ):
+                parts.append(delta)
+                response_callback(delta)
+            return "".join(parts)
         except Exception as e:
             return f"Speaking failed: {e}"
 
-    async def process_full_input(self, text: str, progress_callback=None):
+    async def process_full_input(self, text: str, progress_callback=None, response_callback=None,
+                                 deadline: Optional[float] = None):
         """
         主流程：处理全量输入 -> 异步思考 -> 选择 -> 表达 -> 共识分析
+        共识分析只影响下一轮，所以放到后台执行，回复生成后立即返回；
+        下一轮开始前会先等它合并进共识集
+        :param response_callback: 流式输出回复，见 _speak_response
+        :param deadline: 思考阶段最多等待的秒数 (从开始处理算起)。到点后用已经返回的笔记继续，
+            其余片段的请求取消；为 None 时等所有片段想完
         """
+        # 0. 上一轮的共识分析必须先合并完，本轮的提示词才能用到最新共识
+        stage_start = time.perf_counter()
+        await self._await_consensus()
+        consensus_wait = time.perf_counter() - stage_start
+
         self.full_input_buffer = text
         self.insight_notes = [] # Reset
+        self._shortlist = []
+        # 各阶段耗时 (秒)，用于调并发参数
+        timings = {"consensus_wait": consensus_wait}
+        start = stage_start = time.perf_counter()
         
-        # 1. Chunking
-        chunks = self._chunk_text(text)
-        
-        # 2. Async Listening & Expanding
+        # 1. Chunking & 2. Async Listening & Expanding
+        # 边切分边启动思考任务，不必等整段文本扫描完
+        # 切点由内容决定，修改后重贴的汇报里没变的片段能命中笔记缓存
         tasks = []
-        for i, chunk in enumerate(chunks):
-            tasks.append(self._think_background(chunk, i))
+        for i, chunk in enumerate(iter_chunks(text, stable_boundaries=True)):
+            tasks.append(asyncio.create_task(self._think_background(chunk, i)))
+            # 让出事件循环，刚切好的片段立即发出请求
+            await asyncio.sleep(0)
+        timings["chunk"] = time.perf_counter() - stage_start
         
-        # 并发执行所有思考任务
-        for task in asyncio.as_completed(tasks):
-            await task
+        # 并发执行所有思考任务 (实际同时在跑的请求数由 self.limiter 控制)
+        # 每条笔记返回时就完成本地打分，思考结束后候选名单已经就绪
+        pending = set(tasks)
+        deadline_at = start + deadline if deadline is not None else None
+        while pending:
+            timeout = None if deadline_at is None else max(0.0, deadline_at - time.perf_counter())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break  # 到点了
             if progress_callback:
                 progress_callback(self.insight_notes)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        # 思考阶段从开始切分算起 (与切分重叠)
+        timings["think"] = time.perf_counter() - start
         
         # 3. Focusing & Selecting
+        stage_start = time.perf_counter()
         selected_point = await self._select_best_insight()
+        timings["select"] = time.perf_counter() - stage_start
         
         # 4. Speaking
-        final_response = await self._speak_response(selected_point)
+        stage_start = time.perf_counter()
+        final_response = await self._speak_response(selected_point, response_callback)
+        timings["speak"] = time.perf_counter() - stage_start
         
-        # 5. 共识分析（记录对话历史并分析）
+        # 5. 共识分析（记录对话历史，分析在后台进行）
         self.conversation_history.append({"user": text, "ai": final_response})
-        consensus_result = await self._analyze_consensus(text, final_response)
-        
-        # 更新共识集
-        for consensus in consensus_result.get("confirmed", []):
-            if consensus not in self.confirmed_consensus:
-                self.confirmed_consensus.append(consensus)
-        
-        # 移除已确认的共识（如果有的话）
-        for consensus in consensus_result.get("confirmed", []):
-            if consensus in self.pending_consensus:
-                self.pending_consensus.remove(consensus)
-        
-        # 添加新的待确认共识
-        for new_pending in consensus_result.get("new_pending", []):
-            if new_pending not in self.pending_consensus:
-                self.pending_consensus.append(new_pending)
+        self.save_state()
+        self._start_consensus(text, final_response)
+        timings["total"] = time.perf_counter() - start
         
+        with self._consensus_lock:
+            confirmed_consensus = list(self.confirmed_consensus)
+            pending_consensus = list(self.pending_consensus)
         return {
-            "chunks_count": len(chunks),
+            "chunks_count": len(tasks),
             "insights": self.insight_notes,
+            "reused_chunks": sum(1 for n in self.insight_notes if n.get("reused")),
+            "skipped_chunks": len(pending),
+            "shortlist": [n["id"] for n in self._shortlist_notes()],
             "selected_point": selected_point,
             "response": final_response,
-            "consensus_result": consensus_result,
-            "confirmed_consensus": self.confirmed_consensus,
-            "pending_consensus": self.pending_consensus
+            # 本轮共识分析在后台进行，这里是截至上一轮的共识集；需要时调用 wait_for_consensus()
+            "confirmed_consensus": confirmed_consensus,
+            "pending_consensus": pending_consensus,
+            "timings": timings,
+            "concurrency": self.limiter.stats()
         }
@@ -1,7 +1,37 @@
 # meeting.py
-from typing import List, Optional
-from openai import OpenAI
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from agent import ResearchAgent
+from utils.llm_client import get_client
+from utils.llm_utils import chat_completion
+from utils.token_utils import estimate_tokens, message_tokens, messages_tokens
+
+# 会议上下文：未折叠的最近记录超过这么多 token 就把最早的部分并入共享摘要
+MEETING_WINDOW_TOKENS = 4000
+# 折叠后把未折叠记录压到窗口的多少比例
+MEETING_FOLD_TARGET_RATIO = 0.5
+# 至少保留最近几条发言原文
+MEETING_KEEP_RECENT = 4
+# 会议摘要长度上限 (token)，以及送去摘要时每条发言最多取多少字
+MEETING_SUMMARY_MAX_TOKENS = 1000
+MEETING_FOLD_MESSAGE_CHARS = 2000
+# 每次送去摘要的记录最多多少 token，一次性折叠大段记录时分批并入
+MEETING_FOLD_CHUNK_TOKENS = 8000
+
+# 推测执行：每步结束后预先生成下一位的发言 (本地规则定不了时连主持人点名也在后台预先做)
+# 被丢弃的预生成累计浪费超过这么多 token，或命中率过低时自动停止
+SPECULATION_MAX_WASTED_TOKENS = 30000
+SPECULATION_MIN_HIT_RATE = 0.5
+SPECULATION_WARMUP = 4           # 至少结算这么多次后才按命中率判断
+
+_speculation_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="meeting-speculation")
+
+# 专家发言中只在结尾这么多字里找被点名的人 (点名提问通常在最后，前文提到别人多半是引用或反驳)
+NAME_SCAN_TAIL_CHARS = 200
+_SENTENCE_RE = re.compile(r"[^。！？!?\n]*[。！？!?\n]?")
 
 class MeetingController:
     def __init__(self, api_key: str, base_url: str = None, model: str = "gpt-4o"):
@@ -11,14 +41,37 @@ class MeetingController:
         self.agents: List[ResearchAgent] = [] # 参会专家列表
         self.history = []     # 完整的会议记录
         self.topic = ""       # 当前议题
+        # 会议上下文：history[:self._summarized] 已并入共享摘要 self.summary
+        self.summary = ""
+        self._summarized = 0
+        # 每位专家已经看过的记录位置，下次只发给他这之后的新发言
+        self._seen: Dict[str, int] = {}
         
-        # 主持人自己也需要一个 LLM 大脑来做决策
-        if base_url:
-            self.client = OpenAI(api_key=api_key, base_url=base_url)
-        else:
-            self.client = OpenAI(api_key=api_key)
+        # 主持人自己也需要一个 LLM 大脑来做决策 (和专家共用连接池)
+        self.client = get_client(api_key, base_url)
         self.model = model
 
+        # 点名走了哪条路径的计数：本地规则能定的不再请求大模型
+        self.selection_stats = {
+            "single": 0,          # 只有一位专家
+            "mention": 0,         # 用户 @ 或点名了某位专家
+            "user_followup": 0,   # 用户追问但没指定对象 -> 上一位发言的专家
+            "named_by_expert": 0, # 上一位专家点名了另一位
+            "opening": 0,         # 开场轮，按顺序让还没发过言的专家发言
+            "llm": 0,             # 交给主持人大模型判断
+        }
+
+        # 推测执行 (默认关闭)
+        self.speculative = False
+        self._speculation: Optional[Dict] = None
+        self.speculation_stats = {
+            "started": 0,
+            "hits": 0,            # 点击时直接使用了预生成的发言
+            "misses": 0,          # 记录变了 (用户插话等)，预生成作废
+            "predicted": 0,       # 下一位需要主持人判断，点名请求也放在后台预先发出
+            "wasted_tokens": 0,
+        }
+
     def set_topic(self, topic: str):
         """设定会议议题"""
         self.topic = topic
@@ -26,19 +79,78 @@ class MeetingController:
         self.history = [
             {"role": "user", "content": f"大家好，今天的会议议题是：{topic}。请各位专家依次发表看法。"}
         ]
+        self.summary = ""
+        self._summarized = 0
+        self._seen = {}
 
     def add_agent(self, agent: ResearchAgent):
         """邀请专家入会"""
         self.agents.append(agent)
 
+    def _mentioned_agents(self, text: str, exclude: Optional[str] = None) -> List[ResearchAgent]:
+        """text 中被 @ 或直接提到名字的专家 (有 @ 时只认 @)"""
+        candidates = [a for a in self.agents if a.name != exclude]
+        at_mentioned = [a for a in candidates if f"@{a.name}" in text]
+        if at_mentioned:
+            return at_mentioned
+        return [a for a in candidates if a.name in text]
+
+    def _select_locally(self) -> Optional[Tuple[ResearchAgent, str]]:
+        """
+        本地规则点名，返回 (专家, 命中的规则)；情况不明确时返回 None 交给大模型
+        """
+        if not self.history:
+            return None
+        by_name = {a.name: a for a in self.agents}
+        expert_turns = [m["role"] for m in self.history if m["role"] in by_name]
+        last = self.history[-1]
+
+        if last["role"] == "user":
+            mentioned = self._mentioned_agents(last["content"])
+            if len(mentioned) == 1:
+                return mentioned[0], "mention"
+            # 没指定对象的追问，由上一位发言的专家回答
+            if not mentioned and expert_turns and ("？" in last["content"] or "?" in last["content"]):
+                return by_name[expert_turns[-1]], "user_followup"
+        elif last["role"] in by_name:
+            tail = last["content"][-NAME_SCAN_TAIL_CHARS:]
+            # 先看问句里点了谁的名，再看整个结尾
+            questions = "".join(q for q in _SENTENCE_RE.findall(tail) if q.endswith(("？", "?")) or "请" in q)
+            for text in (questions, tail):
+                mentioned = self._mentioned_agents(text, exclude=last["role"]) if text else []
+                if len(mentioned) == 1:
+                    return mentioned[0], "named_by_expert"
+                if mentioned:
+                    break
+
+        # 开场轮：按顺序让还没发过言的专家发言，不重复
+        spoken = set(expert_turns)
+        for agent in self.agents:
+            if agent.name not in spoken:
+                return agent, "opening"
+        return None
+
     def select_next_speaker(self) -> ResearchAgent:
         """
         【核心逻辑】主持人通过分析上下文，决定下一个谁发言
+        能用本地规则确定的直接返回，只有情况不明确时才请大模型主持人判断
         """
         # 如果只有一个人，那就只能是他了
         if len(self.agents) == 1:
+            self.selection_stats["single"] += 1
             return self.agents[0]
-            
+
+        local = self._select_locally()
+        if local is not None:
+            agent, path = local
+            self.selection_stats[path] += 1
+            return agent
+
+        self.selection_stats["llm"] += 1
+        return self._ask_moderator(self._moderator_prompt())
+
+    def _moderator_prompt(self) -> str:
+        """请大模型主持人点名的提示 (只读当前记录，可以先在主线程拼好再交给后台)"""
         # 1. 准备给主持人的 Prompt
         agent_profiles = "\n".join([f"- {a.name}: {a.system_prompt}" for a in self.agents])
         
@@ -50,7 +162,7 @@ class MeetingController:
             recent_history.append(f"{role}: {content}")
         history_text = "\n".join(recent_history)
 
-        prompt = f"""
+        return f"""
         你是一场科研组会的主持人。
         
         当前议题：{self.topic}
@@ -70,13 +182,15 @@ class MeetingController:
         请仅返回专家的【名字】，不要包含任何其他字符。
         """
 
+    def _ask_moderator(self, prompt: str) -> ResearchAgent:
+        """请大模型主持人点名 (不改动会议状态，可在后台线程调用)"""
         try:
             # 2. 调用 LLM 决策
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            selected_name = response.choices[0].message.content.strip()
+            selected_name = chat_completion(
+                self.client,
+                self.model,
+                [{"role": "user", "content": prompt}]
+            ).strip()
             
             # 3. 匹配名字并返回对象
             for agent in self.agents:
@@ -90,22 +204,89 @@ class MeetingController:
             print(f"主持人掉线了: {e}")
             return self.agents[0]
 
-    def step(self) -> dict:
+    def _fold_history(self):
         """
-        推进会议进行“一步” (Round)
-        :return: 这一轮的发言记录 {"role": "专家名", "content": "发言内容"}
+        未折叠的记录超出窗口时，把最早的部分并入共享摘要 (每条发言只会被摘要一次)
+        每次送去摘要的记录不超过 MEETING_FOLD_CHUNK_TOKENS (从数据库恢复的长会议会分几次折叠)
         """
-        # 1. 主持人点名
-        speaker = self.select_next_speaker()
+        base = self._summarized
+        keep_from = len(self.history) - MEETING_KEEP_RECENT
+        tokens = [message_tokens(m) for m in self.history[base:]]
+        total = sum(tokens)
+        if total <= MEETING_WINDOW_TOKENS or base >= keep_from:
+            return
+
+        target = MEETING_WINDOW_TOKENS * MEETING_FOLD_TARGET_RATIO
+        while total > target and self._summarized < keep_from:
+            end, chunk_tokens = self._summarized, 0
+            while end < keep_from and total > target and chunk_tokens < MEETING_FOLD_CHUNK_TOKENS:
+                total -= tokens[end - base]
+                chunk_tokens += tokens[end - base]
+                end += 1
+            self.summary = self._update_summary(self.history[self._summarized:end])
+            self._summarized = end
+
+    def _update_summary(self, messages: List[Dict]) -> str:
+        """把一段会议记录并入共享摘要"""
+        lines = []
+        for m in messages:
+            text = m["content"]
+            if len(text) > MEETING_FOLD_MESSAGE_CHARS:
+                text = text[:MEETING_FOLD_MESSAGE_CHARS] + "……(已截断)"
+            lines.append(f"[{m['role']}]: {text}")
+        transcript = "\n".join(lines)
+
+        prompt = f"""
+        你是科研组会的记录员。下面是会议的已有摘要，以及紧接其后的会议记录。
+        请把新记录并入摘要，输出更新后的完整摘要。
+        
+        当前议题：{self.topic}
+        
+        【已有摘要】
+        {self.summary or "（无）"}
         
-        # 2. 构造上下文 (RAG 的一种变体)
-        # 我们把整个会议记录拼接成字符串，喂给专家
-        # 提示：实际生产中，如果记录太长，需要做 Summarization (摘要)
-        context_str = "\n".join([f"[{m['role']}]: {m['content']}" for m in self.history])
+        【新记录】
+        {transcript}
         
-        prompt_for_speaker = f"""
-        这是目前的会议记录：
-        {context_str}
+        【要求】
+        1. 按专家归纳各自的核心观点、论据，以及谁质疑了谁、是否得到回应。
+        2. 保留用户的提问和尚未解决的分歧。
+        3. 不超过 {MEETING_SUMMARY_MAX_TOKENS} 个 token，直接输出摘要正文。
+        """
+        try:
+            return chat_completion(
+                self.client,
+                self.model,
+                [{"role": "user", "content": prompt}],
+                max_tokens=MEETING_SUMMARY_MAX_TOKENS,
+            ).strip()
+        except Exception as e:
+            print(f"会议摘要更新失败: {e}")
+            fallback = (self.summary + "\n" + transcript).strip()
+            return fallback[-MEETING_SUMMARY_MAX_TOKENS:]
+
+    def _speaker_prompt(self, speaker: ResearchAgent) -> str:
+        """
+        给发言专家的提示：只包含他上次发言之后的新记录
+        (他错过的部分若已被折叠，则附上共享摘要)，他自己的 history 里只累积增量
+        """
+        start = self._seen.get(speaker.name, 0)
+        parts = []
+        if start < self._summarized:
+            parts.append(f"【会议前情摘要】\n{self.summary}")
+            start = self._summarized
+
+        # 他自己的发言已经在他的 history 里了 (并行开场时可能夹在别人发言中间)
+        delta = [m for m in self.history[start:] if m["role"] != speaker.name]
+        context_str = "\n".join([f"[{m['role']}]: {m['content']}" for m in delta])
+        if speaker.name in self._seen:
+            parts.append(f"自你上次发言以来的会议记录：\n{context_str}")
+        else:
+            parts.append(f"这是目前的会议记录：\n{context_str}")
+        context = "\n\n".join(parts)
+
+        return f"""
+        {context}
         
         轮到你了。请作为【{speaker.name}】，结合你的专业背景({speaker.system_prompt})，
         对刚才的讨论发表看法。
@@ -116,6 +297,24 @@ class MeetingController:
         4. 如果回答超过500字，在最后给出一个100字以内的总结。
         5. 避免重复回答之前说过的内容。
         """
+
+    def step(self) -> dict:
+        """
+        推进会议进行“一步” (Round)
+        :return: 这一轮的发言记录 {"role": "专家名", "content": "发言内容"}
+        """
+        # 0. 有可用的预生成发言就直接用
+        message = self._take_speculation()
+        if message is not None:
+            self.speculate()
+            return message
+
+        # 1. 主持人点名
+        speaker = self.select_next_speaker()
+        
+        # 2. 构造上下文：共享摘要 + 该专家上次发言后的新记录，每轮请求的长度有上界
+        self._fold_history()
+        prompt_for_speaker = self._speaker_prompt(speaker)
         
         # 3. 专家发言
         # 注意：这里我们调用 agent.chat，但不传入图片，纯文字讨论
@@ -124,5 +323,202 @@ class MeetingController:
         # 4. 记录历史
         message = {"role": speaker.name, "content": content}
         self.history.append(message)
+        self._seen[speaker.name] = len(self.history)
+
+        # 5. 趁用户阅读时预生成下一位的发言
+        self.speculate()
         
-        return message
\ No newline at end of file
+        return message
+
+    def interject(self, content: str):
+        """用户插话 (会让预生成的发言作废)"""
+        self.history.append({"role": "user", "content": content})
+        self.cancel_speculation()
+
+    def speculation_hit_rate(self) -> float:
+        settled = self.speculation_stats["hits"] + self.speculation_stats["misses"]
+        return self.speculation_stats["hits"] / settled if settled else 0.0
+
+    def _speculation_allowed(self) -> bool:
+        """成本上限与命中率：浪费太多或猜得不准时不再预生成"""
+        stats = self.speculation_stats
+        if stats["wasted_tokens"] >= SPECULATION_MAX_WASTED_TOKENS:
+            return False
+        settled = stats["hits"] + stats["misses"]
+        return settled < SPECULATION_WARMUP or self.speculation_hit_rate() >= SPECULATION_MIN_HIT_RATE
+
+    def speculate(self):
+        """
+        预测下一位发言人，并在后台生成他的发言 (除折叠记录外不修改会议状态)
+        本地规则能确定时直接预生成；否则主持人大模型的点名也放到后台，和预生成一起受成本上限约束
+        """
+        if not self.speculative or self._speculation is not None or not self._speculation_allowed():
+            return
+        if not self.agents:
+            return
+        # 和 step() 一样先折叠，预生成连续命中时共享摘要也要跟着推进，每轮提示词长度才有上界
+        self._fold_history()
+        spec = {
+            "history_len": len(self.history),
+            "last": self.history[-1] if self.history else None,
+            "moderator_tokens": 0,
+        }
+        local = self._select_locally() if len(self.agents) > 1 else (self.agents[0], "single")
+        if local is not None:
+            speaker, path = local
+            spec.update(speaker=speaker, path=path, draft=speaker.draft(self._speaker_prompt(speaker)))
+            spec["future"] = _speculation_pool.submit(speaker.complete_draft, spec["draft"])
+        else:
+            # 需要主持人判断：提示词在这里按当前记录拼好，后台线程只发请求、不读会议状态
+            moderator_prompt = self._moderator_prompt()
+            prompts = {a.name: self._speaker_prompt(a) for a in self.agents}
+            spec.update(path="llm", moderator_tokens=estimate_tokens(moderator_prompt))
+            spec["future"] = _speculation_pool.submit(self._predict_and_draft, spec, moderator_prompt, prompts)
+            self.speculation_stats["predicted"] += 1
+        self._speculation = spec
+        self.speculation_stats["started"] += 1
+
+    def _predict_and_draft(self, spec: Dict, moderator_prompt: str, prompts: Dict[str, str]):
+        """后台线程：先请主持人点名，再为被点到的专家生成发言"""
+        speaker = self._ask_moderator(moderator_prompt)
+        spec["speaker"] = speaker
+        spec["draft"] = speaker.draft(prompts[speaker.name])
+        speaker.complete_draft(spec["draft"])
+
+    def set_speculative(self, enabled: bool):
+        """开关推测执行：打开时立即开始预生成下一位的发言，关闭时作废已有的预生成"""
+        self.speculative = enabled
+        if enabled:
+            self.speculate()
+        else:
+            self.cancel_speculation()
+
+    def _discard_speculation(self, spec: Dict):
+        """作废一次预生成，已经发出的请求计入浪费"""
+        self.speculation_stats["misses"] += 1
+        if spec["future"].cancel():
+            return
+        self.speculation_stats["wasted_tokens"] += spec["moderator_tokens"]
+        draft = spec.get("draft")
+        if draft is None:
+            # 主持人还没点完名，专家的发言请求还没发出
+            return
+        self.speculation_stats["wasted_tokens"] += messages_tokens(draft["messages"])
+        # 回复还没生成完时按一次典型发言长度估算
+        reply = draft.get("reply")
+        self.speculation_stats["wasted_tokens"] += estimate_tokens(reply) if reply else 500
+
+    def cancel_speculation(self):
+        spec, self._speculation = self._speculation, None
+        if spec is not None:
+            self._discard_speculation(spec)
+
+    def _take_speculation(self) -> Optional[dict]:
+        """会议记录自预生成以来没变时，取出预生成的发言并写入记录"""
+        spec, self._speculation = self._speculation, None
+        if spec is None:
+            return None
+        unchanged = spec["history_len"] == len(self.history) and (
+            not self.history or self.history[-1] is spec["last"]
+        )
+        if not unchanged:
+            self._discard_speculation(spec)
+            return None
+        try:
+            spec["future"].result()
+        except Exception as e:
+            print(f"预生成发言失败: {e}")
+            self._discard_speculation(spec)
+            return None
+        speaker = spec["speaker"]
+        if not speaker.commit_draft(spec["draft"]):
+            self._discard_speculation(spec)
+            return None
+
+        self.speculation_stats["hits"] += 1
+        self.selection_stats[spec["path"]] += 1
+        message = {"role": speaker.name, "content": spec["draft"]["reply"]}
+        self.history.append(message)
+        self._seen[speaker.name] = len(self.history)
+        return message
+
+    def pending_openers(self) -> List[ResearchAgent]:
+        """还没发过言的专家"""
+        spoken = {m["role"] for m in self.history}
+        return [a for a in self.agents if a.name not in spoken]
+
+    def run_opening_round(self, on_message: Optional[Callable[[dict], None]] = None) -> List[dict]:
+        """
+        并行开场：所有还没发过言的专家基于同一份会议记录同时发言
+        各自的请求互不依赖，整轮耗时约等于一次大模型调用
+        :param on_message: 每位专家发言完成时调用 (在当前线程中，按完成顺序)
+        :return: 按完成顺序排列的发言记录
+        """
+        openers = self.pending_openers()
+        if not openers:
+            return []
+        self.cancel_speculation()
+        self._fold_history()
+        snapshot = len(self.history)
+        prompts = {agent.name: self._speaker_prompt(agent) for agent in openers}
+        self.selection_stats["opening"] += len(openers)
+
+        messages = []
+        with ThreadPoolExecutor(max_workers=len(openers)) as pool:
+            futures = {pool.submit(agent.chat, prompts[agent.name]): agent for agent in openers}
+            for future in as_completed(futures):
+                agent = futures[future]
+                message = {"role": agent.name, "content": future.result()}
+                self.history.append(message)
+                # 他只看到了开场前的记录，同轮其他人的开场白下次发言时再补给他
+                self._seen[agent.name] = snapshot
+                messages.append(message)
+                if on_message:
+                    on_message(message)
+        return messages
+
+    def run_autopilot(self, rounds: int = 1, on_message: Optional[Callable[[dict], None]] = None) -> Iterator[dict]:
+        """
+        自动推进 rounds 轮 (每轮发言次数等于专家人数)，在后台线程中运行，每条发言完成就产出
+        还有专家没开过场时，第一轮用并行开场代替
+        调用方停止迭代 (如关闭生成器) 后，后台线程在当前发言结束后停止
+        :param on_message: 在后台线程中对每条发言调用 (如写数据库)，
+            即使调用方提前停止迭代，已经进入 history 的发言也都会经过它
+        """
+        results: "queue.Queue" = queue.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def emit(message):
+            if on_message:
+                on_message(message)
+            results.put(message)
+
+        def worker():
+            try:
+                remaining = rounds
+                if self.pending_openers() and remaining > 0:
+                    self.run_opening_round(on_message=emit)
+                    remaining -= 1
+                for _ in range(remaining * len(self.agents)):
+                    if stop.is_set():
+                        break
+                    emit(self.step())
+                results.put(done)
+            except Exception as e:
+                results.put(e)
+
+        thread = threading.Thread(target=worker, name="meeting-autopilot", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = results.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            # 等当前这次发言结束，之后调用方再动 history 就不会和后台线程冲突
+            thread.join()
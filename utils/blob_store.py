@@ -0,0 +1,113 @@
+# utils/blob_store.py
+"""
+大段消息正文的去重压缩存储
+
+超过 BLOB_THRESHOLD 字的正文按 sha256 存进 blobs 表 (同一篇论文 / 报告只存一份)，
+messages.content 里只留前 BLOB_PREVIEW_CHARS 字作为预览 (列表展示用)，
+messages.blob_hash 指向完整正文，读取时再解压。全文索引按完整正文建立 (见 db_utils._insert_messages)。
+"""
+import hashlib
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+try:
+    import zstandard
+except ImportError:  # 没装 zstandard 时退回标准库 zlib
+    zstandard = None
+
+BLOB_THRESHOLD = 4096       # 正文超过多少字才单独存储
+BLOB_PREVIEW_CHARS = 1000   # messages.content 中保留的预览字数
+BLOB_CACHE_SIZE = 32        # 解压结果的内存缓存条数
+
+DEFAULT_CODEC = "zstd" if zstandard is not None else "zlib"
+
+
+def compress(text: str, codec: str = DEFAULT_CODEC) -> bytes:
+    raw = text.encode("utf-8")
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(raw)
+    return zlib.compress(raw, 6)
+
+
+def decompress(data: bytes, codec: str) -> str:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("该正文使用 zstd 压缩，需要先安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def split_content(c: sqlite3.Cursor, content: str):
+    """
+    决定一条消息正文怎么存：短正文原样返回；长正文写入 blobs 表 (已存在则跳过)
+    必须在写事务中调用，并在同一事务里写入引用它的消息，否则并发的 delete_orphan_blobs
+    可能在检查之后、消息写入之前删掉这份正文
+    :return: (messages.content 要存的内容, blob_hash 或 None)
+    """
+    if len(content) <= BLOB_THRESHOLD:
+        return content, None
+    digest = content_hash(content)
+    c.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,))
+    if c.fetchone() is None:
+        c.execute(
+            "INSERT OR IGNORE INTO blobs (hash, codec, size, data) VALUES (?, ?, ?, ?)",
+            (digest, DEFAULT_CODEC, len(content), compress(content))
+        )
+    return content[:BLOB_PREVIEW_CHARS], digest
+
+
+# 解压后的正文缓存：同一篇 PDF 在多次刷新中反复读取时不必重复解压
+_cache: "OrderedDict[str, str]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def load_blobs(c: sqlite3.Cursor, hashes: Iterable[str]) -> Dict[str, str]:
+    """批量读取并解压正文，返回 hash -> 完整正文"""
+    result, missing = {}, []
+    with _cache_lock:
+        for digest in set(hashes):
+            if digest in _cache:
+                _cache.move_to_end(digest)
+                result[digest] = _cache[digest]
+            else:
+                missing.append(digest)
+    if not missing:
+        return result
+
+    c.execute(
+        f"SELECT hash, codec, data FROM blobs WHERE hash IN ({','.join('?' * len(missing))})",
+        missing
+    )
+    loaded = {row[0]: decompress(row[2], row[1]) for row in c.fetchall()}
+    with _cache_lock:
+        for digest, text in loaded.items():
+            _cache[digest] = text
+            _cache.move_to_end(digest)
+        while len(_cache) > BLOB_CACHE_SIZE:
+            _cache.popitem(last=False)
+    result.update(loaded)
+    return result
+
+
+def delete_orphan_blobs(c: sqlite3.Cursor, hashes: Optional[Iterable[str]] = None):
+    """删除没有任何消息引用的正文；传入 hashes 时只检查这些"""
+    if hashes is None:
+        c.execute("DELETE FROM blobs WHERE NOT EXISTS (SELECT 1 FROM messages WHERE blob_hash = blobs.hash)")
+        return
+    hashes = list(set(hashes))
+    if not hashes:
+        return
+    c.execute(
+        f"""
+        DELETE FROM blobs WHERE hash IN ({','.join('?' * len(hashes))})
+          AND NOT EXISTS (SELECT 1 FROM messages WHERE blob_hash = blobs.hash)
+        """,
+        hashes
+    )
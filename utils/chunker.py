@@ -0,0 +1,111 @@
+# utils/chunker.py
+"""
+流式分块器
+
+按句子边界把长文本切成 token 数受控的片段，边扫描边产出，调用方可以在整段文本扫完之前
+就开始处理前面的片段。每个句子只计数一次、只拷贝常数次，多兆字节的输入也是线性时间。
+"""
+import re
+import zlib
+from collections import deque
+from typing import Callable, Iterable, Iterator, Tuple, Union
+
+from utils.token_utils import estimate_tokens
+
+CHUNK_MAX_TOKENS = 300
+CHUNK_OVERLAP_TOKENS = 0
+
+# 句子结束：中文句末标点、英文 !? 、换行，以及后面跟空白的英文句点
+SENTENCE_END_RE = re.compile(r"[。！？!?\n]|\.(?=\s)")
+# 内容定义切点：块长度达到 max_tokens 的这个比例后，句子哈希能被模数整除就切
+STABLE_MIN_RATIO = 0.4
+STABLE_BOUNDARY_MODULUS = 4
+# 找不到句末标点时，缓冲区最多积累这么多字符 (相对 max_tokens) 就强制当成一句
+MAX_SENTENCE_CHARS_PER_TOKEN = 4
+
+
+def _split_long(sentence: str, tokens: int, max_tokens: int, count: Callable[[str], int]) -> Iterator[Tuple[str, int]]:
+    """超过 max_tokens 的单句按字符比例硬切"""
+    step = max(1, int(len(sentence) * max_tokens / tokens))
+    for i in range(0, len(sentence), step):
+        piece = sentence[i:i + step]
+        yield piece, count(piece)
+
+
+def iter_sentences(text: Union[str, Iterable[str]], max_chars: int = 0) -> Iterator[str]:
+    """
+    逐句产出 (保留句末标点)
+    :param text: 完整字符串，或按顺序到达的字符串片段 (如流式输入)
+    :param max_chars: 大于 0 时，没有句末标点的内容累计超过这个长度也会被当作一句产出
+    """
+    pieces = [text] if isinstance(text, str) else text
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        start = 0
+        for m in SENTENCE_END_RE.finditer(buffer):
+            yield buffer[start:m.end()]
+            start = m.end()
+        buffer = buffer[start:]
+        if max_chars and len(buffer) > max_chars:
+            yield buffer
+            buffer = ""
+    if buffer:
+        yield buffer
+
+
+def iter_chunks(
+    text: Union[str, Iterable[str]],
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+    stable_boundaries: bool = False,
+) -> Iterator[str]:
+    """
+    按 token 数分块，块内尽量装满整句，不超过 max_tokens
+    :param overlap_tokens: 相邻块之间重复的 token 数上限 (按整句回带上一块末尾的内容)
+    :param stable_boundaries: 按句子内容的哈希决定切点 (块至少 STABLE_MIN_RATIO * max_tokens)。
+        文本前面改了几句时，后面未改动部分的切点不变，切出的片段可以按哈希复用
+    """
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+    min_tokens = max_tokens * STABLE_MIN_RATIO
+    current = deque()   # (句子, token 数)
+    current_tokens = 0
+    has_new = False     # 当前块里是否有上一块没出现过的内容
+
+    def trim(reserve: int):
+        # 只保留末尾不超过 overlap_tokens 的整句作为下一块的开头
+        nonlocal current_tokens
+        while current and (current_tokens > overlap_tokens or current_tokens + reserve > max_tokens):
+            current_tokens -= current.popleft()[1]
+
+    for sentence in iter_sentences(text, max_chars=max_tokens * MAX_SENTENCE_CHARS_PER_TOKEN):
+        tokens = count_tokens(sentence)
+        if tokens == 0:
+            continue
+        parts = _split_long(sentence, tokens, max_tokens, count_tokens) if tokens > max_tokens else ((sentence, tokens),)
+
+        for part, part_tokens in parts:
+            if current and current_tokens + part_tokens > max_tokens:
+                if has_new:
+                    chunk = "".join(s for s, _ in current).strip()
+                    if chunk:
+                        yield chunk
+                trim(part_tokens)
+                has_new = False
+            current.append((part, part_tokens))
+            current_tokens += part_tokens
+            has_new = True
+
+            if (stable_boundaries and current_tokens >= min_tokens
+                    and zlib.crc32(part.encode("utf-8")) % STABLE_BOUNDARY_MODULUS == 0):
+                chunk = "".join(s for s, _ in current).strip()
+                if chunk:
+                    yield chunk
+                trim(0)
+                has_new = False
+
+    if current and has_new:
+        chunk = "".join(s for s, _ in current).strip()
+        if chunk:
+            yield chunk
@@ -0,0 +1,203 @@
+# utils/concurrency.py
+"""
+自适应并发控制 (AIMD)
+
+每个 (base_url, model) 一个进程级的并发限制器，所有聚焦会话共用同一份并发额度：
+- 请求成功且延迟正常时，并发上限缓慢加一 (加性增)
+- 请求失败或延迟明显变长时，并发上限减半 (乘性减)，并有冷却时间避免一次拥塞连续减好几次
+- 排队的请求按会话 (owner) 轮转放行，一个会话的长文不会把其他会话饿死
+
+Streamlit 每个会话在自己的线程里 asyncio.run，各自有事件循环，
+所以状态用线程锁保护，排队的协程通过 loop.call_soon_threadsafe 唤醒。
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Hashable, Optional, Tuple
+
+CONCURRENCY_INITIAL = 4
+CONCURRENCY_MIN = 1
+CONCURRENCY_MAX = 16
+
+BACKOFF_RATIO = 0.5          # 拥塞时并发上限乘以这个系数
+LATENCY_TOLERANCE = 2.0      # 单次延迟超过平均延迟的这么多倍视为拥塞
+LATENCY_EWMA_ALPHA = 0.2
+DECREASE_COOLDOWN = 2.0      # 两次减小之间至少间隔的秒数
+
+# slot 内实际网络请求的耗时，由 llm_utils 在请求完成时上报；
+# 限流等待、重试退避不计入，没有发出请求 (比如命中缓存) 时保持 None
+_request_latency: ContextVar[Optional[float]] = ContextVar("request_latency", default=None)
+
+
+def report_request_latency(seconds: float):
+    """上报一次网络请求的耗时，供外层的 slot 判断是否拥塞"""
+    _request_latency.set(seconds)
+
+
+class _Waiter:
+    __slots__ = ("loop", "future", "granted")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+
+def _grant(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial: int = CONCURRENCY_INITIAL, min_limit: int = CONCURRENCY_MIN,
+                 max_limit: int = CONCURRENCY_MAX):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.in_flight = 0
+        self._queues: "OrderedDict[Hashable, Deque[_Waiter]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._latency: Optional[float] = None
+        self._last_decrease = 0.0
+        # 统计
+        self.successes = 0
+        self.failures = 0
+        self.decreases = 0
+
+    async def acquire(self, owner: Hashable = None):
+        """获取一个并发名额，额度不够时排队等待"""
+        waiter = None
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._queues:
+                self.in_flight += 1
+                return
+            waiter = _Waiter(asyncio.get_running_loop())
+            self._queues.setdefault(owner, deque()).append(waiter)
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    # 名额已经分配但没来得及用，还回去
+                    self.in_flight -= 1
+                    self._wake_locked()
+                else:
+                    # 可能已被 _wake_locked 取出 (future 已取消所以没有分配名额)，这时不在队列里
+                    queue = self._queues.get(owner)
+                    if queue is not None and waiter in queue:
+                        queue.remove(waiter)
+                        if not queue:
+                            del self._queues[owner]
+            raise
+
+    def release(self, success: Optional[bool] = True, latency: Optional[float] = None):
+        """归还名额，并根据结果调整并发上限 (success 为 None 时只归还，不调整)"""
+        with self._lock:
+            self.in_flight -= 1
+            if success is not None:
+                self._adjust(success, latency)
+            self._wake_locked()
+
+    @asynccontextmanager
+    async def slot(self, owner: Hashable = None):
+        """
+        async with limiter.slot(owner): ... 按是否抛异常记录成功 / 失败，延迟取 report_request_latency 上报的值
+        被调用方取消的请求、没有真正发出请求 (命中缓存) 的调用都不调整并发上限
+        """
+        await self.acquire(owner)
+        token = _request_latency.set(None)
+        success = False
+        try:
+            yield
+            success = True
+        except asyncio.CancelledError:
+            success = None
+            raise
+        finally:
+            latency = _request_latency.get()
+            _request_latency.reset(token)
+            if success and latency is None:
+                success = None
+            self.release(success, latency)
+
+    def _adjust(self, success: bool, latency: Optional[float]):
+        congested = not success
+        if success:
+            self.successes += 1
+            if latency is not None:
+                if self._latency is not None and latency > self._latency * LATENCY_TOLERANCE:
+                    congested = True
+                self._latency = latency if self._latency is None else (
+                    (1 - LATENCY_EWMA_ALPHA) * self._latency + LATENCY_EWMA_ALPHA * latency
+                )
+        else:
+            self.failures += 1
+
+        if congested:
+            now = time.monotonic()
+            if now - self._last_decrease >= DECREASE_COOLDOWN:
+                self.limit = max(float(self.min_limit), self.limit * BACKOFF_RATIO)
+                self._last_decrease = now
+                self.decreases += 1
+        else:
+            # 大约每跑满一轮并发加 1
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+    def _wake_locked(self):
+        """按会话轮转放行排队的请求 (调用方需持有锁)"""
+        while self.in_flight < int(self.limit) and self._queues:
+            owner, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(owner)
+            else:
+                del self._queues[owner]
+            if waiter.future.done():
+                continue
+            try:
+                waiter.loop.call_soon_threadsafe(_grant, waiter.future)
+            except RuntimeError:
+                # 对应的事件循环已经关闭
+                continue
+            waiter.granted = True
+            self.in_flight += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "waiting": sum(len(q) for q in self._queues.values()),
+                "successes": self.successes,
+                "failures": self.failures,
+                "decreases": self.decreases,
+                "avg_latency": round(self._latency, 3) if self._latency is not None else None,
+            }
+
+
+_limiters: Dict[Tuple[str, str], AdaptiveLimiter] = {}
+_settings: Dict[Tuple[str, str], Tuple[int, int, int]] = {}
+_limiters_lock = threading.Lock()
+
+
+def set_concurrency_limits(base_url: Optional[str], model: str, initial: int = CONCURRENCY_INITIAL,
+                           min_limit: int = CONCURRENCY_MIN, max_limit: int = CONCURRENCY_MAX):
+    """设置某服务商 / 模型的并发范围 (会替换已有的限制器)"""
+    key = (str(base_url or ""), model)
+    with _limiters_lock:
+        _settings[key] = (initial, min_limit, max_limit)
+        _limiters[key] = AdaptiveLimiter(initial, min_limit, max_limit)
+
+
+def get_concurrency_limiter(base_url: Optional[str], model: str) -> AdaptiveLimiter:
+    key = (str(base_url or ""), model)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = AdaptiveLimiter(*_settings.get(key, (CONCURRENCY_INITIAL, CONCURRENCY_MIN, CONCURRENCY_MAX)))
+            _limiters[key] = limiter
+        return limiter
@@ -0,0 +1,290 @@
+# utils/db_migrations.py
+"""
+数据库结构的版本化迁移
+
+当前版本号保存在 SQLite 的 PRAGMA user_version 中。
+新增表结构时，在 MIGRATIONS 末尾追加一项 (版本号, 说明, 函数)，不要修改已发布的迁移。
+"""
+import sqlite3
+from typing import Optional
+
+from utils.blob_store import BLOB_THRESHOLD, decompress, split_content
+
+
+def _v1_initial_schema(c: sqlite3.Cursor):
+    # 1. 会话表 (Sessions)
+    # session_id: 我们生成的唯一标识符 (UUID)
+    # session_type: 类型 (chat=单聊, meeting=组会, focus=聚焦对话)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT UNIQUE NOT NULL,
+            title TEXT,
+            session_type TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 2. 消息表 (Messages)
+    # role: 发言角色 (user, assistant, 专家名, system_insights 等)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(session_id) REFERENCES sessions(session_id)
+        )
+    ''')
+
+
+def _v2_cascade_and_indexes(c: sqlite3.Cursor):
+    # SQLite 不能给已有外键加 ON DELETE CASCADE，只能重建 messages 表
+    # 已经没有对应会话的孤儿消息放不进带外键的新表，先原样挪到 orphan_messages 保留下来
+    orphan_filter = "session_id NOT IN (SELECT session_id FROM sessions)"
+    orphans = c.execute(f"SELECT count(*) FROM messages WHERE {orphan_filter}").fetchone()[0]
+    if orphans:
+        c.execute("CREATE TABLE IF NOT EXISTS orphan_messages AS SELECT * FROM messages WHERE 0")
+        c.execute(f"INSERT INTO orphan_messages SELECT * FROM messages WHERE {orphan_filter}")
+        print(f"⚠️ 发现 {orphans} 条没有对应会话的消息，已移到 orphan_messages 表保留")
+
+    c.execute('''
+        CREATE TABLE messages_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(session_id) REFERENCES sessions(session_id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute('''
+        INSERT INTO messages_new (id, session_id, role, content, created_at)
+        SELECT id, session_id, role, content, created_at FROM messages
+        WHERE session_id IN (SELECT session_id FROM sessions)
+    ''')
+    c.execute("DROP TABLE messages")
+    c.execute("ALTER TABLE messages_new RENAME TO messages")
+
+    # get_messages: WHERE session_id = ? ORDER BY id
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages(session_id, id)")
+    # get_all_sessions: ORDER BY created_at DESC
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions(created_at)")
+
+
+def _fts_tokenizer(c: sqlite3.Cursor) -> str:
+    """中文没有空格分词，优先用 trigram (SQLite >= 3.34)，否则退回 unicode61"""
+    try:
+        c.execute("CREATE VIRTUAL TABLE temp.fts_probe USING fts5(x, tokenize='trigram')")
+        c.execute("DROP TABLE temp.fts_probe")
+        return "trigram"
+    except sqlite3.OperationalError:
+        return "unicode61"
+
+
+def _v3_full_text_search(c: sqlite3.Cursor):
+    tokenizer = _fts_tokenizer(c)
+    # 外部内容表：索引里不重复存正文，snippet 直接回表读取
+    c.execute(f"""
+        CREATE VIRTUAL TABLE messages_fts USING fts5(
+            content, content='messages', content_rowid='id', tokenize='{tokenizer}'
+        )
+    """)
+    c.execute(f"""
+        CREATE VIRTUAL TABLE sessions_fts USING fts5(
+            title, content='sessions', content_rowid='id', tokenize='{tokenizer}'
+        )
+    """)
+    # 词表视图：短于 3 个字的查询词需要靠它展开成 trigram
+    c.execute("CREATE VIRTUAL TABLE messages_fts_vocab USING fts5vocab(messages_fts, 'row')")
+    c.execute("CREATE VIRTUAL TABLE sessions_fts_vocab USING fts5vocab(sessions_fts, 'row')")
+
+    # 触发器保持索引与原表同步 (级联删除同样会触发)
+    for table, fts, column in (("messages", "messages_fts", "content"), ("sessions", "sessions_fts", "title")):
+        c.execute(f"""
+            CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column});
+            END
+        """)
+        c.execute(f"""
+            CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+            END
+        """)
+        c.execute(f"""
+            CREATE TRIGGER {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column});
+            END
+        """)
+        # 为已有数据建索引
+        c.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def _v4_blob_storage(c: sqlite3.Cursor):
+    # 大段正文去重压缩存储，见 utils/blob_store.py
+    c.execute('''
+        CREATE TABLE blobs (
+            hash TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    c.execute("ALTER TABLE messages ADD COLUMN blob_hash TEXT")
+    c.execute("CREATE INDEX idx_messages_blob_hash ON messages(blob_hash) WHERE blob_hash IS NOT NULL")
+
+    # 把已有的长消息搬进 blobs 表
+    rows = c.execute("SELECT id, content FROM messages WHERE length(content) > ?", (BLOB_THRESHOLD,)).fetchall()
+    for message_id, content in rows:
+        preview, digest = split_content(c, content)
+        if digest is not None:
+            c.execute("UPDATE messages SET content = ?, blob_hash = ? WHERE id = ?", (preview, digest, message_id))
+
+
+def _v5_llm_cache(c: sqlite3.Cursor):
+    # 大模型响应缓存，见 utils/llm_cache.py (通用缓存表结构，tag 存模型名，见 utils/sqlite_cache.py)
+    c.execute('''
+        CREATE TABLE llm_cache (
+            key TEXT PRIMARY KEY,
+            tag TEXT,
+            value TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    c.execute("CREATE INDEX idx_llm_cache_last_used ON llm_cache(last_used)")
+
+
+def _v6_focus_state(c: sqlite3.Cursor):
+    # 聚焦模式会话状态 (共识集、对话历史)，压缩后的 JSON，随会话级联删除
+    c.execute('''
+        CREATE TABLE focus_state (
+            session_id TEXT PRIMARY KEY REFERENCES sessions(session_id) ON DELETE CASCADE,
+            codec TEXT NOT NULL,
+            state BLOB NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+def _v7_session_minutes(c: sqlite3.Cursor):
+    # 会议 / 对话的滚动纪要：last_message_id 之前的消息都已整理进 minutes，随会话级联删除
+    c.execute('''
+        CREATE TABLE session_minutes (
+            session_id TEXT PRIMARY KEY REFERENCES sessions(session_id) ON DELETE CASCADE,
+            minutes TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+def _v8_pdf_text_cache(c: sqlite3.Cursor):
+    # PDF 提取结果缓存 (按文件内容哈希)，见 utils/file_utils.py (通用缓存表结构，tag 存压缩编码)
+    c.execute('''
+        CREATE TABLE pdf_text_cache (
+            key TEXT PRIMARY KEY,
+            tag TEXT,
+            value BLOB NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    c.execute("CREATE INDEX idx_pdf_text_cache_last_used ON pdf_text_cache(last_used)")
+
+
+def _v9_index_full_blob_text(c: sqlite3.Cursor):
+    # 长消息在 messages.content 里只有预览，全文检索要索引完整正文：
+    # 索引触发器只处理没有 blob 的短消息，长消息由写入 / 删除代码用完整正文维护 (见 db_utils)
+    c.execute("DROP TRIGGER messages_fts_ai")
+    c.execute("DROP TRIGGER messages_fts_ad")
+    c.execute("DROP TRIGGER messages_fts_au")
+    c.execute('''
+        CREATE TRIGGER messages_fts_ai AFTER INSERT ON messages WHEN new.blob_hash IS NULL BEGIN
+            INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER messages_fts_ad AFTER DELETE ON messages WHEN old.blob_hash IS NULL BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content)
+                SELECT 'delete', old.id, old.content WHERE old.blob_hash IS NULL;
+            INSERT INTO messages_fts(rowid, content)
+                SELECT new.id, new.content WHERE new.blob_hash IS NULL;
+        END
+    ''')
+
+    # 已有的长消息：索引里目前是预览，换成完整正文
+    rows = c.execute('''
+        SELECT m.id, m.content, b.codec, b.data FROM messages m JOIN blobs b ON b.hash = m.blob_hash
+    ''').fetchall()
+    for message_id, preview, codec, data in rows:
+        try:
+            body = decompress(data, codec)
+        except RuntimeError as e:
+            # 缺少解压库时保留预览的索引
+            print(f"消息 {message_id} 的正文无法解压，全文检索只覆盖预览: {e}")
+            continue
+        c.execute("INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', ?, ?)", (message_id, preview))
+        c.execute("INSERT INTO messages_fts(rowid, content) VALUES (?, ?)", (message_id, body))
+
+
+MIGRATIONS = [
+    (1, "初始表结构 sessions / messages", _v1_initial_schema),
+    (2, "消息随会话级联删除 + 热点查询索引", _v2_cascade_and_indexes),
+    (3, "FTS5 全文检索 (消息内容 / 会话标题)", _v3_full_text_search),
+    (4, "长消息正文去重压缩存储", _v4_blob_storage),
+    (5, "大模型响应缓存", _v5_llm_cache),
+    (6, "聚焦模式会话状态持久化", _v6_focus_state),
+    (7, "会议 / 对话滚动纪要", _v7_session_minutes),
+    (8, "PDF 提取结果缓存", _v8_pdf_text_cache),
+    (9, "长消息按完整正文建全文索引", _v9_index_full_blob_text),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, target: Optional[int] = None) -> int:
+    """
+    把数据库升级到 target 版本 (默认最新)，返回升级后的版本号
+    每个迁移在独立事务中执行，多个进程同时启动时只有一个会真正执行
+    """
+    target = LATEST_VERSION if target is None else target
+    if get_schema_version(conn) >= target:
+        return get_schema_version(conn)
+
+    # 重建表期间必须关闭外键检查；该 PRAGMA 在事务内无效，所以放在事务外面
+    foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    conn.execute("PRAGMA foreign_keys=OFF")
+    try:
+        for version, _description, apply in MIGRATIONS:
+            if version > target:
+                break
+            c = conn.cursor()
+            try:
+                c.execute("BEGIN IMMEDIATE")
+                # 拿到写锁后再确认一次，可能别的进程已经升级过了
+                if get_schema_version(conn) >= version:
+                    conn.rollback()
+                    continue
+                apply(c)
+                c.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                c.close()
+    finally:
+        conn.execute(f"PRAGMA foreign_keys={'ON' if foreign_keys else 'OFF'}")
+    return get_schema_version(conn)
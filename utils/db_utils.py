@@ -1,75 +1,625 @@
 # utils/db_utils.py
+import atexit
+import json
 import sqlite3
+import threading
+import time
 import uuid
-from typing import List, Dict, Optional
+from contextlib import contextmanager
+from typing import Iterator, List, Dict, Optional, Sequence
+from utils.blob_store import compress, decompress, split_content, load_blobs, delete_orphan_blobs
+from utils.db_migrations import migrate
 
 DB_PATH = 'scholar.db'
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+# 连接参数：写锁被占用时最多等待多久 (毫秒)，而不是立刻报 "database is locked"
+BUSY_TIMEOUT_MS = 5000
+
+# 连接池大小 (每个数据库文件)。Streamlit 每次 rerun 都在新的脚本线程里执行，
+# 所以连接不能跟线程绑定：用完即还回共享池，由后续任意线程复用
+DB_POOL_SIZE = 8
+
+# 每个进程对每个数据库文件只做一次迁移检查
+_migrated_paths = set()
+_migrate_lock = threading.Lock()
+
+def _open_connection(db_path: str) -> sqlite3.Connection:
+    # 连接会在不同线程间传递 (同一时刻只有一个线程使用)，所以关闭同线程检查
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
     conn.row_factory = sqlite3.Row # 让查询结果变成字典一样的对象，方便读取
+    # WAL 模式：读写互不阻塞，多个用户同时刷新页面时不会互相卡住
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL 下 NORMAL 已经足够安全 (断电最多丢最后一个事务)，每次提交少一次 fsync
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    # 首次打开时把旧库原地升级到最新表结构
+    if db_path not in _migrated_paths:
+        with _migrate_lock:
+            if db_path not in _migrated_paths:
+                migrate(conn)
+                _migrated_paths.add(db_path)
+    # 删除会话时级联删除其消息
+    conn.execute("PRAGMA foreign_keys=ON")
     return conn
 
+class _ConnectionPool:
+    """某个数据库文件的有界连接池，连接按需创建，最多 size 个，用完后放回空闲列表"""
+
+    def __init__(self, db_path: str, size: int):
+        self.db_path = db_path
+        self.size = size
+        self._idle: List[sqlite3.Connection] = []
+        self._created = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        try:
+            return _open_connection(self.db_path)
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn: sqlite3.Connection):
+        # 借用方没提交的事务不能带给下一个使用者
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def close_idle(self):
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+            self._created -= len(self._idle)
+            self._idle.clear()
+
+_pools: Dict[str, _ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+# 当前线程正在借用的连接：db_cursor 嵌套使用时复用同一个连接 (同一事务)，不会重复占用池里的名额
+_local = threading.local()
+
+def _get_pool() -> _ConnectionPool:
+    with _pools_lock:
+        pool = _pools.get(DB_PATH)
+        if pool is None:
+            pool = _pools[DB_PATH] = _ConnectionPool(DB_PATH, DB_POOL_SIZE)
+        return pool
+
+def close_db_connection():
+    """关闭连接池里空闲的连接 (切换数据库或退出前调用)"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_idle()
+
+@contextmanager
+def db_cursor(commit: bool = False):
+    """
+    从连接池借一个连接执行 SQL，退出时归还
+    :param commit: 为 True 时在退出时提交；出错则回滚
+    """
+    borrowed = getattr(_local, "borrowed", None)
+    if borrowed is not None and borrowed[0] is _get_pool():
+        pool, conn = borrowed
+        owner = False
+    else:
+        pool = _get_pool()
+        conn = pool.acquire()
+        _local.borrowed = (pool, conn)
+        owner = True
+    cursor = conn.cursor()
+    try:
+        yield cursor
+        if commit:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        if owner:
+            _local.borrowed = None
+            pool.release(conn)
+
+# --- 写后缓冲 (Write-behind) ---
+# 开启后 add_message 只把消息放进内存队列，由后台线程攒成一批后用一个事务写入，
+# UI 线程不再为每条消息等一次提交。读取同一会话前会自动 flush，保证读到自己刚写的内容。
+
+WRITE_BEHIND_MAX_BATCH = 100       # 攒够多少条立即写
+WRITE_BEHIND_FLUSH_INTERVAL = 0.2  # 最早一条消息最多等待多久 (秒)
+WRITE_BEHIND_FLUSH_TIMEOUT = 10.0  # 读取前等待后台写入的上限 (秒)，超时后由调用方自己写入剩余消息
+
+class MessageWriter:
+    """后台批量写消息的线程"""
+
+    def __init__(self, max_batch: int = WRITE_BEHIND_MAX_BATCH, flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._cond = threading.Condition()
+        self._pending = []          # [(session_id, role, content)]
+        self._first_pending_at = 0.0
+        self._enqueued_seq = 0      # 已入队的消息序号
+        self._flushed_seq = 0       # 已落盘的消息序号
+        self._sync_seq = 0          # 调用方同步写入时取走的最大序号
+        self._session_seq = {}      # session_id -> 该会话最后一条入队消息的序号
+        self._force = False
+        self._in_flight = False     # 后台线程是否正拿着一批消息在写
+        self._thread = None
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        # 后台线程意外退出时重新拉起，避免之后的消息永远留在队列里
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+            self._thread.start()
+
+    def put(self, session_id: str, role: str, content: str):
+        with self._cond:
+            self._ensure_thread()
+            first = not self._pending
+            if first:
+                self._first_pending_at = time.monotonic()
+            self._pending.append((session_id, role, content))
+            self._enqueued_seq += 1
+            self._session_seq[session_id] = self._enqueued_seq
+            # 第一条消息唤醒后台线程开始计时；攒够一批时让它立刻写
+            if first or len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+
+    def flush(self, session_id: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """
+        等待已入队的消息落盘
+        :param session_id: 只等待该会话的消息；为空则等待全部
+        :return: 超时返回 False
+        """
+        with self._cond:
+            self._ensure_thread()
+            if session_id is None:
+                target = self._enqueued_seq
+            else:
+                target = self._session_seq.get(session_id, 0)
+            if self._flushed_seq >= target:
+                return True
+            self._force = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._flushed_seq >= target, timeout)
+
+    def write_pending_now(self):
+        """
+        在调用方线程里直接写入还没被后台线程取走的消息 (后台线程卡住时的兜底)
+        后台线程手上那一批仍由它自己写完，所以这时落盘顺序可能与入队顺序不同
+        """
+        with self._cond:
+            batch, self._pending = self._pending, []
+            taken_seq = self._enqueued_seq
+        self._write(batch)
+        with self._cond:
+            self._sync_seq = max(self._sync_seq, taken_seq)
+            if not self._in_flight:
+                self._mark_flushed_locked(taken_seq)
+
+    def _mark_flushed_locked(self, seq: int):
+        self._flushed_seq = max(self._flushed_seq, seq)
+        for sid in [sid for sid, s in self._session_seq.items() if s <= self._flushed_seq]:
+            del self._session_seq[sid]
+        self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # 攒批：数量到阈值、等待超时或有人要求 flush 时写入
+                deadline = self._first_pending_at + self.flush_interval
+                while len(self._pending) < self.max_batch and not self._force:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending, []
+                self._force = False
+                batch_seq = self._enqueued_seq
+                self._in_flight = True
+
+            try:
+                self._write(batch)
+            finally:
+                # 无论写入成功与否都要推进序号并唤醒等待者，否则 flush() 会一直等下去
+                with self._cond:
+                    self._in_flight = False
+                    self._mark_flushed_locked(max(batch_seq, self._sync_seq))
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            with db_cursor(commit=True) as c:
+                _insert_messages(c, batch)
+        except Exception as e:
+            # 整批失败时逐条重试，避免一条坏数据 (比如会话已被删除、正文含非法字符) 连累其他消息
+            print(f"批量写入消息失败，改为逐条写入: {e}")
+            for row in batch:
+                try:
+                    with db_cursor(commit=True) as c:
+                        _insert_messages(c, [row])
+                except Exception as row_error:
+                    print(f"丢弃无法写入的消息 (session={row[0]}, role={row[1]}): {row_error}")
+
+_writer: Optional[MessageWriter] = None
+_writer_lock = threading.Lock()
+
+def enable_write_behind(max_batch: int = WRITE_BEHIND_MAX_BATCH, flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL):
+    """开启写后缓冲 (重复调用无副作用)"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = MessageWriter(max_batch, flush_interval)
+            atexit.register(_flush_or_write, None)
+
+def flush(session_id: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+    """把缓冲中的消息写入数据库；未开启写后缓冲时直接返回"""
+    if _writer is None:
+        return True
+    return _writer.flush(session_id, timeout)
+
+def _flush_or_write(session_id: Optional[str] = None):
+    """读库前 (和退出前) 使用：最多等 WRITE_BEHIND_FLUSH_TIMEOUT 秒，超时则在当前线程直接写入剩余消息"""
+    if _writer is None:
+        return
+    if not _writer.flush(session_id, WRITE_BEHIND_FLUSH_TIMEOUT):
+        print(f"等待后台写入消息超时 ({WRITE_BEHIND_FLUSH_TIMEOUT} 秒)，改为直接写入")
+        _writer.write_pending_now()
+
 # --- 会话 (Session) 管理 ---
 
 def create_session(title: str, session_type: str) -> str:
     """创建一个新会话，返回 session_id"""
     session_id = str(uuid.uuid4())
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO sessions (session_id, title, session_type) VALUES (?, ?, ?)",
-        (session_id, title, session_type)
-    )
-    conn.commit()
-    conn.close()
+    with db_cursor(commit=True) as c:
+        c.execute(
+            "INSERT INTO sessions (session_id, title, session_type) VALUES (?, ?, ?)",
+            (session_id, title, session_type)
+        )
     return session_id
 
 def get_all_sessions() -> List[Dict]:
     """获取所有会话列表（按时间倒序）"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM sessions ORDER BY created_at DESC")
-    sessions = [dict(row) for row in c.fetchall()]
-    conn.close()
-    return sessions
+    with db_cursor() as c:
+        c.execute("SELECT * FROM sessions ORDER BY created_at DESC")
+        return [dict(row) for row in c.fetchall()]
 
 def get_session_info(session_id: str) -> Optional[Dict]:
     """获取单个会话的详细信息"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,))
-    row = c.fetchone()
-    conn.close()
+    with db_cursor() as c:
+        c.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,))
+        row = c.fetchone()
     return dict(row) if row else None
 
 def delete_session(session_id: str):
-    """删除会话"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
-    c.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
-    conn.commit()
-    conn.close()
+    """删除会话 (消息通过外键 ON DELETE CASCADE 一并删除)"""
+    _flush_or_write(session_id)
+    with db_cursor(commit=True) as c:
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT id, blob_hash FROM messages WHERE session_id = ? AND blob_hash IS NOT NULL", (session_id,))
+        blob_rows = c.fetchall()
+        blob_hashes = [row["blob_hash"] for row in blob_rows]
+        # 长消息的全文索引是按完整正文建的，删除时也要给出完整正文 (触发器只处理短消息)
+        bodies = load_blobs(c, blob_hashes)
+        c.executemany(
+            "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', ?, ?)",
+            [(row["id"], bodies[row["blob_hash"]]) for row in blob_rows if row["blob_hash"] in bodies]
+        )
+        c.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        # 其他会话没再引用的大段正文一起清掉
+        delete_orphan_blobs(c, blob_hashes)
+
+# --- 聚焦模式状态 (Focus State) ---
+
+def save_focus_state(session_id: str, state: Dict):
+    """保存聚焦会话的状态 (JSON 压缩后整体覆盖)"""
+    data = compress(json.dumps(state, ensure_ascii=False, separators=(",", ":")), "zlib")
+    with db_cursor(commit=True) as c:
+        c.execute(
+            "INSERT OR REPLACE INTO focus_state (session_id, codec, state, updated_at) VALUES (?, ?, ?, ?)",
+            (session_id, "zlib", data, time.time())
+        )
+
+def load_focus_state(session_id: str) -> Optional[Dict]:
+    """读取聚焦会话的状态，没有保存过时返回 None"""
+    with db_cursor() as c:
+        c.execute("SELECT codec, state FROM focus_state WHERE session_id = ?", (session_id,))
+        row = c.fetchone()
+    if row is None:
+        return None
+    return json.loads(decompress(row["state"], row["codec"]))
+
+# --- 滚动纪要 (Minutes) ---
+
+def save_minutes(session_id: str, minutes: str, last_message_id: int, message_count: int):
+    """保存会话的滚动纪要；已存的版本更新 (last_message_id 更大) 时不覆盖"""
+    with db_cursor(commit=True) as c:
+        c.execute(
+            """
+            INSERT INTO session_minutes (session_id, minutes, last_message_id, message_count, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(session_id) DO UPDATE SET
+                minutes = excluded.minutes,
+                last_message_id = excluded.last_message_id,
+                message_count = excluded.message_count,
+                updated_at = excluded.updated_at
+            WHERE excluded.last_message_id > session_minutes.last_message_id
+            """,
+            (session_id, minutes, last_message_id, message_count, time.time())
+        )
+
+def get_minutes(session_id: str) -> Optional[Dict]:
+    """读取会话的滚动纪要 {minutes, last_message_id, message_count, updated_at}，没有时返回 None"""
+    with db_cursor() as c:
+        c.execute(
+            "SELECT minutes, last_message_id, message_count, updated_at FROM session_minutes WHERE session_id = ?",
+            (session_id,)
+        )
+        row = c.fetchone()
+    return dict(row) if row else None
 
 # --- 消息 (Message) 管理 ---
 
+def _insert_messages(c: sqlite3.Cursor, rows):
+    """在当前事务中写入多条 (session_id, role, content)，长正文转存到 blobs 表"""
+    # 先拿写锁：正文是否已存在的检查和消息写入要在同一个写事务里，中间不能被删除会话插进来
+    if not c.connection.in_transaction:
+        c.execute("BEGIN IMMEDIATE")
+    for session_id, role, content in rows:
+        stored, blob_hash = split_content(c, content)
+        c.execute(
+            "INSERT INTO messages (session_id, role, content, blob_hash) VALUES (?, ?, ?, ?)",
+            (session_id, role, stored, blob_hash)
+        )
+        if blob_hash is not None:
+            # 触发器只索引短消息；长消息用完整正文建索引，超过预览长度的内容也能搜到
+            c.execute("INSERT INTO messages_fts(rowid, content) VALUES (?, ?)", (c.lastrowid, content))
+
+def _resolve_bodies(c: sqlite3.Cursor, rows: List[Dict], with_body: bool) -> List[Dict]:
+    """把长消息的预览替换成完整正文 (with_body=False 时保留预览，不解压)"""
+    if with_body:
+        hashes = [row["blob_hash"] for row in rows if row["blob_hash"]]
+        if hashes:
+            bodies = load_blobs(c, hashes)
+            for row in rows:
+                if row["blob_hash"]:
+                    row["content"] = bodies.get(row["blob_hash"], row["content"])
+    for row in rows:
+        del row["blob_hash"]
+    return rows
+
 def add_message(session_id: str, role: str, content: str):
-    """保存一条消息"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
-        (session_id, role, str(content)) # 确保 content 是字符串
-    )
-    conn.commit()
-    conn.close()
-
-def get_messages(session_id: str) -> List[Dict]:
-    """获取某会话的所有消息"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT role, content FROM messages WHERE session_id = ? ORDER BY id ASC", (session_id,))
-    messages = [dict(row) for row in c.fetchall()]
-    conn.close()
-    return messages
\ No newline at end of file
+    """保存一条消息 (开启写后缓冲时异步写入)"""
+    if _writer is not None:
+        _writer.put(session_id, role, str(content))
+        return
+    with db_cursor(commit=True) as c:
+        _insert_messages(c, [(session_id, role, str(content))]) # 确保 content 是字符串
+
+# 游标分页时每次从数据库取多少条
+MESSAGE_PAGE_SIZE = 200
+
+def _role_filter(roles: Optional[Sequence[str]], exclude_roles: Optional[Sequence[str]]):
+    """拼出按角色过滤的 SQL 片段和参数"""
+    sql, params = "", []
+    if roles:
+        sql += f" AND role IN ({','.join('?' * len(roles))})"
+        params.extend(roles)
+    if exclude_roles:
+        sql += f" AND role NOT IN ({','.join('?' * len(exclude_roles))})"
+        params.extend(exclude_roles)
+    return sql, params
+
+def get_messages(
+    session_id: str,
+    roles: Optional[Sequence[str]] = None,
+    exclude_roles: Optional[Sequence[str]] = None,
+    with_body: bool = True,
+) -> List[Dict]:
+    """
+    获取某会话的所有消息
+    :param roles: 只要这些角色的消息
+    :param exclude_roles: 排除这些角色的消息 (例如 system_agents_config)
+    :param with_body: 为 False 时长消息只返回预览，不读取、不解压完整正文
+    """
+    _flush_or_write(session_id)
+    role_sql, role_params = _role_filter(roles, exclude_roles)
+    with db_cursor() as c:
+        c.execute(
+            f"SELECT role, content, blob_hash FROM messages WHERE session_id = ?{role_sql} ORDER BY id ASC",
+            (session_id, *role_params)
+        )
+        return _resolve_bodies(c, [dict(row) for row in c.fetchall()], with_body)
+
+def iter_messages(
+    session_id: str,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    roles: Optional[Sequence[str]] = None,
+    exclude_roles: Optional[Sequence[str]] = None,
+    page_size: int = MESSAGE_PAGE_SIZE,
+    with_body: bool = True,
+) -> Iterator[Dict]:
+    """
+    按 id 游标 (keyset) 分页逐条读取消息，不会一次把整段对话载入内存
+    :param after_id: 只返回 id 大于它的消息 (上次读到的最后一条的 id)
+    :param limit: 最多返回多少条，为空则读到末尾
+    :param with_body: 为 False 时长消息只返回预览
+    :return: {"id", "role", "content"} 的迭代器
+    """
+    _flush_or_write(session_id)
+    role_sql, role_params = _role_filter(roles, exclude_roles)
+    last_id = after_id or 0
+    remaining = limit
+    while remaining is None or remaining > 0:
+        batch = page_size if remaining is None else min(page_size, remaining)
+        with db_cursor() as c:
+            c.execute(
+                f"SELECT id, role, content, blob_hash FROM messages WHERE session_id = ? AND id > ?{role_sql} ORDER BY id ASC LIMIT ?",
+                (session_id, last_id, *role_params, batch)
+            )
+            rows = _resolve_bodies(c, [dict(row) for row in c.fetchall()], with_body)
+        for row in rows:
+            yield row
+        if len(rows) < batch:
+            return
+        last_id = rows[-1]["id"]
+        if remaining is not None:
+            remaining -= len(rows)
+
+def get_last_messages(
+    session_id: str,
+    n: int,
+    roles: Optional[Sequence[str]] = None,
+    exclude_roles: Optional[Sequence[str]] = None,
+    with_body: bool = True,
+) -> List[Dict]:
+    """获取某会话最近的 n 条消息 (按时间正序)，每条包含 id/role/content"""
+    _flush_or_write(session_id)
+    role_sql, role_params = _role_filter(roles, exclude_roles)
+    with db_cursor() as c:
+        c.execute(
+            f"SELECT id, role, content, blob_hash FROM messages WHERE session_id = ?{role_sql} ORDER BY id DESC LIMIT ?",
+            (session_id, *role_params, n)
+        )
+        rows = _resolve_bodies(c, [dict(row) for row in c.fetchall()], with_body)
+    rows.reverse()
+    return rows
+
+# --- 全文检索 (Search) ---
+# 索引使用 trigram 分词：3 个字及以上的词直接匹配；
+# 更短的词 (如 "模型") 通过词表展开成以它开头的 trigram 再做 OR 查询。
+# 以短词结尾的 trigram 需要扫描整个词表，只对会话标题这种小索引启用。
+
+SEARCH_SHORT_TERM_EXPANSION = 64  # 短词最多展开成多少个 trigram
+SEARCH_CANDIDATES = 500           # 命中不超过这么多条时才按相关度排序
+SEARCH_SNIPPET_WIDTH = 48         # 摘要片段的大致字数
+# 不参与检索的内部消息：专家配置、聚焦模式的笔记 (都是序列化的 JSON)
+SEARCH_EXCLUDED_ROLES = ("system_agents_config", "system_insights")
+
+def _fts_query(c: sqlite3.Cursor, vocab_table: str, query: str, match_suffix: bool = False) -> Optional[str]:
+    """把用户输入转换成 FTS5 MATCH 表达式；没有可匹配的词时返回 None"""
+    groups = []
+    for term in query.split():
+        if len(term) >= 3:
+            groups.append('"' + term.replace('"', '""') + '"')
+            continue
+        # trigram 索引不区分大小写，词表里存的是小写
+        term = term.lower()
+        # 词表按 term 有序，范围查询只扫描以该词开头的那一段
+        c.execute(
+            f"SELECT term FROM {vocab_table} WHERE term >= ? AND term < ? LIMIT ?",
+            (term, term + "\U0010ffff", SEARCH_SHORT_TERM_EXPANSION)
+        )
+        terms = [row["term"] for row in c.fetchall()]
+        if match_suffix:
+            c.execute(
+                f"SELECT term FROM {vocab_table} WHERE substr(term, -?) = ? LIMIT ?",
+                (len(term), term, SEARCH_SHORT_TERM_EXPANSION)
+            )
+            terms.extend(row["term"] for row in c.fetchall())
+        expanded = ['"' + t.replace('"', '""') + '"' for t in dict.fromkeys(terms)]
+        if not expanded:
+            return None
+        groups.append("(" + " OR ".join(expanded) + ")")
+    return " AND ".join(groups) if groups else None
+
+def _make_snippet(content: str, terms: List[str], width: int = SEARCH_SNIPPET_WIDTH) -> str:
+    """截取第一个命中词附近的一段文字，并用 ** 标出命中词"""
+    lowered = content.lower()
+    positions = [(lowered.find(t), t) for t in terms if lowered.find(t) >= 0]
+    if not positions:
+        return content[:width] + ("…" if len(content) > width else "")
+    pos, term = min(positions)
+    start = max(0, pos - width // 2)
+    end = min(len(content), pos + len(term) + width // 2)
+    snippet = content[start:pos] + "**" + content[pos:pos + len(term)] + "**" + content[pos + len(term):end]
+    return ("…" if start > 0 else "") + snippet + ("…" if end < len(content) else "")
+
+def search_messages(query: str, limit: int = 20) -> List[Dict]:
+    """
+    在所有会话的消息中全文检索
+    命中不多时按相关度 (bm25) 排序；命中超过 SEARCH_CANDIDATES 条的宽泛查询改为按时间倒序，
+    因为 bm25 需要扫描每个词的完整倒排表，在百万级消息上会拖慢到数百毫秒
+    :return: [{"session_id", "title", "session_type", "message_id", "role", "snippet"}]
+    """
+    _flush_or_write()
+    with db_cursor() as c:
+        match = _fts_query(c, "messages_fts_vocab", query)
+        if match is None:
+            return []
+        # 1. 按 rowid 倒序取候选：FTS5 可以边扫边停，代价和命中总数无关
+        #    内部消息在这一步按主键回表排除，不占结果名额
+        role_sql, role_params = _role_filter(None, SEARCH_EXCLUDED_ROLES)
+        c.execute(
+            f"""
+            SELECT f.rowid FROM messages_fts f JOIN messages ON messages.id = f.rowid
+            WHERE messages_fts MATCH ?{role_sql} ORDER BY f.rowid DESC LIMIT ?
+            """,
+            (match, *role_params, SEARCH_CANDIDATES + 1)
+        )
+        candidates = [row["rowid"] for row in c.fetchall()]
+        if not candidates:
+            return []
+        if len(candidates) <= SEARCH_CANDIDATES:
+            c.execute(
+                f"""
+                SELECT f.rowid FROM messages_fts f JOIN messages ON messages.id = f.rowid
+                WHERE messages_fts MATCH ?{role_sql} ORDER BY f.rank
+                """,
+                (match, *role_params)
+            )
+            candidates = [row["rowid"] for row in c.fetchall()]
+        order = {rowid: i for i, rowid in enumerate(candidates[:limit])}
+
+        # 2. 按主键取回结果；FTS5 的 snippet() 在 MATCH 内会重新扫描倒排表，摘要改为自己截取
+        c.execute(
+            f"""
+            SELECT s.session_id, s.title, s.session_type, m.id AS message_id, m.role, m.content
+            FROM messages m
+            JOIN sessions s ON s.session_id = m.session_id
+            WHERE m.id IN ({','.join('?' * len(order))})
+            """,
+            tuple(order)
+        )
+        rows = [dict(row) for row in c.fetchall()]
+    rows.sort(key=lambda row: order[row["message_id"]])
+    terms = [t.lower() for t in query.split()]
+    hits = []
+    for row in rows:
+        row["snippet"] = _make_snippet(row.pop("content"), terms)
+        hits.append(row)
+    return hits
+
+def search_sessions(query: str, limit: int = 20) -> List[Dict]:
+    """按标题全文检索会话，按相关度排序"""
+    with db_cursor() as c:
+        match = _fts_query(c, "sessions_fts_vocab", query, match_suffix=True)
+        if match is None:
+            return []
+        c.execute(
+            """
+            SELECT s.*
+            FROM sessions_fts
+            JOIN sessions s ON s.id = sessions_fts.rowid
+            WHERE sessions_fts MATCH ?
+            ORDER BY sessions_fts.rank
+            LIMIT ?
+            """,
+            (match, limit)
+        )
+        return [dict(row) for row in c.fetchall()]
@@ -1,26 +1,122 @@
 # utils/file_utils.py
+"""
+上传文件处理
+
+PDF 直接从内存解析，不落临时文件；页数多的论文分段交给进程池并行解析。
+提取结果按文件内容哈希缓存 (进程内 LRU + scholar.db 的 pdf_text_cache 表，见 utils/sqlite_cache.py)，
+同一份 PDF 重新上传或 Streamlit 每次 rerun 时只需算一次哈希。
+"""
 import base64
-from langchain_community.document_loaders import PyPDFLoader
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+from pypdf import PdfReader
+
+from utils.blob_store import compress, decompress
+from utils.sqlite_cache import SQLiteLRUCache
+
+PDF_PARALLEL_MIN_PAGES = 30       # 页数达到这个值才用进程池
+PDF_MAX_WORKERS = min(4, os.cpu_count() or 1)
+PDF_MEMORY_CACHE_SIZE = 16
+PDF_DISK_CACHE_MAX_ENTRIES = 500
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+_memory_cache: "OrderedDict[str, str]" = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+# 磁盘缓存：tag 存压缩编码，value 存压缩后的全文
+pdf_cache = SQLiteLRUCache("pdf_text_cache", "PDF 缓存", PDF_DISK_CACHE_MAX_ENTRIES)
+
+
+def _extract_pages(data: bytes, start: int, stop: int) -> List[str]:
+    """解析第 start 到 stop-1 页 (在子进程中运行，所以各自从字节重新打开)"""
+    reader = PdfReader(io.BytesIO(data))
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # Streamlit 进程里有写库线程、事件循环线程等，fork 可能把别的线程持有的锁带进子进程导致死锁，
+            # 所以用 spawn 启动干净的子进程
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+
+def _reset_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
+
+
+def _parse_pdf(data: bytes) -> Tuple[str, int]:
+    """返回 (全文, 页数)；页数多时按页段并行解析"""
+    page_count = len(PdfReader(io.BytesIO(data)).pages)
+    if page_count < PDF_PARALLEL_MIN_PAGES or PDF_MAX_WORKERS <= 1:
+        pages = _extract_pages(data, 0, page_count)
+    else:
+        # 每个子进程只分到一段连续的页，整份 PDF 的字节对每个子进程只传一次
+        step = -(-page_count // PDF_MAX_WORKERS)
+        ranges = [(i, min(i + step, page_count)) for i in range(0, page_count, step)]
+        try:
+            pool = _get_pdf_pool()
+            futures = [pool.submit(_extract_pages, data, start, stop) for start, stop in ranges]
+            pages = [text for future in futures for text in future.result()]
+        except BrokenProcessPool:
+            # 子进程异常退出，重建进程池，这次先串行解析
+            _reset_pdf_pool()
+            pages = _extract_pages(data, 0, page_count)
+    return "\n\n".join(pages), page_count
+
+
+def _memory_get(digest: str) -> Optional[str]:
+    with _memory_cache_lock:
+        text = _memory_cache.get(digest)
+        if text is not None:
+            _memory_cache.move_to_end(digest)
+        return text
+
+
+def _memory_put(digest: str, text: str):
+    with _memory_cache_lock:
+        _memory_cache[digest] = text
+        _memory_cache.move_to_end(digest)
+        while len(_memory_cache) > PDF_MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
 
 def extract_text_from_pdf(uploaded_file) -> str:
     """
-    从 Streamlit 的 UploadedFile 对象中提取文本
+    从 Streamlit 的 UploadedFile 对象中提取文本 (也接受 bytes)
     """
     try:
-        # Streamlit 的上传文件是内存对象，LangChain 通常需要文件路径
-        # 所以我们先把它保存为临时文件
-        temp_filename = f"temp_{uploaded_file.name}"
-        with open(temp_filename, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-            
-        # 使用 LangChain 加载 PDF
-        loader = PyPDFLoader(temp_filename)
-        pages = loader.load()
-        
-        # 提取所有页面的文本
-        full_text = "\n\n".join([page.page_content for page in pages])
-        return full_text
-        
+        data = uploaded_file if isinstance(uploaded_file, bytes) else uploaded_file.getvalue()
+        digest = hashlib.sha256(data).hexdigest()
+
+        text = _memory_get(digest)
+        if text is not None:
+            return text
+        data_z, codec = pdf_cache.get_with_tag(digest)
+        if data_z is not None:
+            text = decompress(data_z, codec)
+        else:
+            text, _pages = _parse_pdf(data)
+            pdf_cache.put(digest, "zlib", compress(text, "zlib"))
+        _memory_put(digest, text)
+        return text
+
     except Exception as e:
         return f"PDF 解析失败: {str(e)}"
 
@@ -33,4 +129,4 @@ def encode_image_to_base64(uploaded_file) -> str:
         return base64.b64encode(bytes_data).decode('utf-8')
     except Exception as e:
         print(f"图片转码失败: {e}")
-        return ""
\ No newline at end of file
+        return ""
@@ -0,0 +1,36 @@
+# utils/llm_cache.py
+"""
+大模型响应缓存 (存放在 scholar.db 的 llm_cache 表)
+
+以 (服务地址, 模型, 消息, 参数) 的哈希为键，相同请求直接返回上次的回复，不再消耗 token。
+按最近使用时间做 LRU 淘汰，并有过期时间 (见 utils/sqlite_cache.py)。
+"""
+import hashlib
+import json
+from typing import Dict, List, Optional
+
+from utils.sqlite_cache import SQLiteLRUCache
+
+LLM_CACHE_ENABLED = True
+LLM_CACHE_MAX_ENTRIES = 5000            # 超过后淘汰最久未使用的
+LLM_CACHE_TTL_SECONDS = 7 * 24 * 3600   # 超过这个时间的缓存视为过期
+
+
+def cache_key(model: str, messages: List[Dict], params: Dict, base_url: Optional[str] = None) -> str:
+    """base_url 参与缓存键：不同服务商上同名的模型不共用缓存"""
+    payload = json.dumps(
+        {"base_url": str(base_url or ""), "model": model, "messages": messages, "params": params},
+        ensure_ascii=False, sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache(SQLiteLRUCache):
+    """tag 列存模型名，value 列存回复文本"""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl_seconds: float = LLM_CACHE_TTL_SECONDS):
+        super().__init__("llm_cache", "LLM 缓存", max_entries, ttl_seconds)
+
+
+# 进程内共享的默认缓存
+llm_cache = LLMCache()
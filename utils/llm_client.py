@@ -0,0 +1,113 @@
+# utils/llm_client.py
+"""
+进程级共享的大模型客户端
+
+同一个 (base_url, api_key) 只创建一个 OpenAI 客户端，所有专家 / 主持人 / 编辑共用一个
+keep-alive 连接池，Streamlit 每次重建 agent 时不再重复 TLS 握手。
+
+AsyncOpenAI 的连接池绑定在事件循环上 (聚焦模式每轮都 asyncio.run 一个新循环)，
+所以异步客户端按 (base_url, api_key, 事件循环) 共享，循环关闭后自动丢弃。
+
+重试由 utils.rate_limit 统一负责 (带限流与 Retry-After)，这里关闭 SDK 自带的重试，避免重复重试。
+"""
+import asyncio
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI, Timeout
+
+# 连接池上限的类型 openai 没有导出，从 SDK 自己依赖的 HTTP 库取 (新版 SDK 基于 httpx2，旧版基于 httpx)
+try:
+    from httpx2 import Limits
+except ImportError:
+    from httpx import Limits
+
+# 连接池与超时配置 (调用 configure_http 修改，只影响之后新建的客户端)
+HTTP_MAX_CONNECTIONS = 32
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 16
+HTTP_KEEPALIVE_EXPIRY = 60.0     # 空闲连接保留多久 (秒)
+HTTP_CONNECT_TIMEOUT = 10.0
+HTTP_READ_TIMEOUT = 120.0        # 长回答可能需要较长时间
+
+_lock = threading.Lock()
+_clients: Dict[Tuple[Optional[str], str], OpenAI] = {}
+_async_clients: Dict[Tuple[Optional[str], str, int], Tuple[weakref.ref, AsyncOpenAI]] = {}
+
+
+def configure_http(
+    max_connections: Optional[int] = None,
+    max_keepalive_connections: Optional[int] = None,
+    keepalive_expiry: Optional[float] = None,
+    connect_timeout: Optional[float] = None,
+    read_timeout: Optional[float] = None,
+):
+    """修改连接池上限与超时，并清空已缓存的客户端"""
+    global HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY
+    global HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+    with _lock:
+        if max_connections is not None:
+            HTTP_MAX_CONNECTIONS = max_connections
+        if max_keepalive_connections is not None:
+            HTTP_MAX_KEEPALIVE_CONNECTIONS = max_keepalive_connections
+        if keepalive_expiry is not None:
+            HTTP_KEEPALIVE_EXPIRY = keepalive_expiry
+        if connect_timeout is not None:
+            HTTP_CONNECT_TIMEOUT = connect_timeout
+        if read_timeout is not None:
+            HTTP_READ_TIMEOUT = read_timeout
+        _clients.clear()
+        _async_clients.clear()
+
+
+def _limits() -> Limits:
+    return Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout() -> Timeout:
+    return Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def get_client(api_key: str, base_url: Optional[str] = None) -> OpenAI:
+    """获取共享的同步客户端 (base_url 为空时连 OpenAI 官方)"""
+    key = (base_url, api_key)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=_timeout(),
+                max_retries=0,
+                http_client=DefaultHttpxClient(limits=_limits(), timeout=_timeout()),
+            )
+            _clients[key] = client
+        return client
+
+
+def get_async_client(api_key: str, base_url: Optional[str] = None) -> AsyncOpenAI:
+    """获取当前事件循环下共享的异步客户端 (必须在协程中调用)"""
+    loop = asyncio.get_running_loop()
+    key = (base_url, api_key, id(loop))
+    with _lock:
+        # 顺手清理已关闭循环的客户端
+        for stale in [k for k, (loop_ref, _) in _async_clients.items()
+                      if loop_ref() is None or loop_ref().is_closed()]:
+            del _async_clients[stale]
+
+        entry = _async_clients.get(key)
+        if entry is not None and entry[0]() is loop:
+            return entry[1]
+        client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=_timeout(),
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(limits=_limits(), timeout=_timeout()),
+        )
+        _async_clients[key] = (weakref.ref(loop), client)
+        return client
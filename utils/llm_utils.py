@@ -0,0 +1,181 @@
+# utils/llm_utils.py
+"""
+统一的大模型调用入口
+
+agent.py / meeting.py / focus_mode.py 中所有 chat.completions.create 调用都经过这里，
+这样缓存、限流与重试等横切逻辑只需要写一份。函数直接返回回复文本。
+"""
+import asyncio
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from utils.concurrency import report_request_latency
+from utils.llm_cache import LLM_CACHE_ENABLED, cache_key, llm_cache
+from utils.rate_limit import (
+    DEFAULT_COMPLETION_TOKENS, acall_with_retry, call_with_retry, get_rate_limiter
+)
+from utils.token_utils import messages_tokens
+
+
+def _limiter_for(client, model: str, messages: List[Dict], params: Dict):
+    """按 (base_url, model) 取共享限流器，并估算本次请求消耗的 token (输入 + 预计输出)"""
+    limiter = get_rate_limiter(getattr(client, "base_url", None), model)
+    tokens = messages_tokens(messages) + (params.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+    return limiter, tokens
+
+
+async def _timed(fn):
+    """执行一次请求并上报耗时 (只计这一次请求本身，供自适应并发判断拥塞)"""
+    start = time.monotonic()
+    result = await fn()
+    report_request_latency(time.monotonic() - start)
+    return result
+
+
+def _cache_key(client, model: str, messages: List[Dict], params: Dict) -> str:
+    return cache_key(model, messages, params, getattr(client, "base_url", None))
+
+
+async def acached_completion(client, model: str, messages: List[Dict], **params) -> Optional[str]:
+    """只查缓存、不发请求：命中返回缓存的回复，否则返回 None (参数与 achat_completion 相同)"""
+    if not LLM_CACHE_ENABLED:
+        return None
+    # 未命中时调用方还会走 achat_completion，那次再计入未命中
+    return await asyncio.to_thread(llm_cache.get, _cache_key(client, model, messages, params), False)
+
+
+def chat_completion(client, model: str, messages: List[Dict], use_cache: bool = True, **params) -> str:
+    """
+    同步调用，返回回复文本
+    :param use_cache: 为 False 时跳过缓存 (既不读也不写)
+    :param params: 透传给 chat.completions.create 的其他参数 (也参与缓存键)
+    """
+    use_cache = use_cache and LLM_CACHE_ENABLED
+    if use_cache:
+        key = _cache_key(client, model, messages, params)
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return cached
+
+    limiter, tokens = _limiter_for(client, model, messages, params)
+    response = call_with_retry(
+        lambda: client.chat.completions.create(model=model, messages=messages, **params),
+        limiter, tokens
+    )
+    reply = response.choices[0].message.content
+
+    if use_cache:
+        llm_cache.put(key, model, reply)
+    return reply
+
+
+async def achat_completion(client, model: str, messages: List[Dict], use_cache: bool = True, **params) -> str:
+    """异步版本的 chat_completion (client 为 AsyncOpenAI)"""
+    use_cache = use_cache and LLM_CACHE_ENABLED
+    if use_cache:
+        key = _cache_key(client, model, messages, params)
+        # 缓存读写走同步的 sqlite 连接，放到线程里执行，不阻塞事件循环
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            return cached
+
+    limiter, tokens = _limiter_for(client, model, messages, params)
+    response = await acall_with_retry(
+        lambda: _timed(lambda: client.chat.completions.create(model=model, messages=messages, **params)),
+        limiter, tokens
+    )
+    reply = response.choices[0].message.content
+
+    if use_cache:
+        await asyncio.to_thread(llm_cache.put, key, model, reply)
+    return reply
+
+
+def stream_chat_completion(client, model: str, messages: List[Dict], use_cache: bool = True, **params) -> Iterator[str]:
+    """
+    流式调用，逐段产出回复文本
+    命中缓存时一次性产出完整回复；未命中时在完整生成后写入缓存 (中途中断不写)
+    只在收到第一段内容之前重试，已经输出给界面的内容不会重复
+    """
+    use_cache = use_cache and LLM_CACHE_ENABLED
+    if use_cache:
+        key = _cache_key(client, model, messages, params)
+        cached = llm_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    limiter, tokens = _limiter_for(client, model, messages, params)
+    stream = call_with_retry(lambda: _open_stream(client, model, messages, params), limiter, tokens)
+    parts = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield delta
+
+    if use_cache:
+        llm_cache.put(key, model, "".join(parts))
+
+
+async def astream_chat_completion(client, model: str, messages: List[Dict], use_cache: bool = True, **params) -> AsyncIterator[str]:
+    """异步版本的 stream_chat_completion (client 为 AsyncOpenAI)"""
+    use_cache = use_cache and LLM_CACHE_ENABLED
+    if use_cache:
+        key = _cache_key(client, model, messages, params)
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            yield cached
+            return
+
+    limiter, tokens = _limiter_for(client, model, messages, params)
+    # 流式请求的耗时记到第一个数据块到达为止
+    stream = await acall_with_retry(lambda: _timed(lambda: _aopen_stream(client, model, messages, params)), limiter, tokens)
+    parts = []
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield delta
+
+    if use_cache:
+        await asyncio.to_thread(llm_cache.put, key, model, "".join(parts))
+
+
+def _open_stream(client, model: str, messages: List[Dict], params: Dict):
+    """发起流式请求并读到第一个数据块，连接 / 限流错误在这里抛出以便重试"""
+    stream = client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+    iterator = iter(stream)
+    try:
+        first = next(iterator)
+    except StopIteration:
+        return iter(())
+    return _prepend(first, iterator)
+
+
+def _prepend(first, iterator):
+    yield first
+    yield from iterator
+
+
+async def _aopen_stream(client, model: str, messages: List[Dict], params: Dict):
+    """异步版本的 _open_stream"""
+    stream = await client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+    iterator = stream.__aiter__()
+    try:
+        first = await iterator.__anext__()
+    except StopAsyncIteration:
+        return _aprepend(None, iterator)
+    return _aprepend(first, iterator)
+
+
+async def _aprepend(first, iterator):
+    if first is None:
+        return
+    yield first
+    async for chunk in iterator:
+        yield chunk
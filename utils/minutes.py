@@ -0,0 +1,122 @@
+# utils/minutes.py
+"""
+滚动纪要 (Live Minutes)
+
+会议 / 对话每新增 MINUTES_UPDATE_EVERY 条消息，就在后台把这些新消息并入数据库里的纪要，
+每次只处理新增部分。点击生成纪要时直接读出已保存的纪要，耗时与会议长短无关；
+需要时再基于纪要和少量未整理的新消息做一次润色。
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from utils.db_utils import get_minutes, iter_messages, save_minutes
+from utils.llm_client import get_client
+from utils.llm_utils import chat_completion
+from utils.summarizer import condense_transcript, transcript_lines
+
+MINUTES_UPDATE_EVERY = 6
+MINUTES_MAX_TOKENS = 1500
+# 不属于讨论内容的消息 (专家配置、聚焦模式的笔记)
+MINUTES_EXCLUDE_ROLES = ("system_agents_config", "system_insights")
+
+# 后台更新纪要的线程池；同一会话同时只有一个更新在跑
+_minutes_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="minutes")
+_running = set()
+_dirty = set()
+_lock = threading.Lock()
+
+
+def pending_messages(session_id: str, minutes: Optional[Dict] = None,
+                     exclude_roles: Sequence[str] = MINUTES_EXCLUDE_ROLES, with_body: bool = True) -> List[Dict]:
+    """
+    还没整理进纪要的消息
+    :param with_body: 为 False 时长消息只返回预览 (只需要条数和 id 时用，不解压正文)
+    """
+    after_id = minutes["last_message_id"] if minutes else 0
+    return list(iter_messages(session_id, after_id=after_id, exclude_roles=list(exclude_roles), with_body=with_body))
+
+
+def _merge_prompt(minutes: str, new_records: str) -> str:
+    return f"""
+        请把新的讨论记录并入已有的会议纪要，输出更新后的完整纪要。
+
+        【已有纪要】
+        {minutes or "(暂无)"}
+
+        【新的讨论记录】
+        {new_records}
+
+        【要求】
+        1. 使用 markdown 格式，保持以下结构：
+           - 💡 核心观点摘要 (Abstract)
+           - ⚔️ 主要争议/讨论过程,重点记录user的问题以及讨论出的结论 (Discussion)
+           - 📌 下一步建议或结论 (Conclusion)
+        2. 保留已有纪要中的要点，新内容补充到对应部分；观点有更新时以新记录为准。
+        3. 不超过 {MINUTES_MAX_TOKENS} 个 token，直接输出纪要。
+        """
+
+
+def update_minutes(client, model: str, session_id: str, min_new: int = MINUTES_UPDATE_EVERY,
+                   use_cache: bool = True) -> Optional[Dict]:
+    """
+    新消息攒够 min_new 条时把它们并入纪要并保存，返回最新的纪要记录 (没有纪要时返回 None)
+    :param min_new: 新消息少于这个数时不更新；传 1 表示只要有新消息就更新
+    """
+    stored = get_minutes(session_id)
+    # 大多数调用新消息都不够，先只数条数，够了再读完整正文
+    if len(pending_messages(session_id, stored, with_body=False)) < max(min_new, 1):
+        return stored
+    new_messages = pending_messages(session_id, stored)
+
+    # 新消息一般只有几条；积压很多时 (比如老会话第一次整理) 先分段摘要
+    new_records = condense_transcript(client, model, new_messages, use_cache=use_cache)
+    minutes = chat_completion(
+        client,
+        model,
+        [
+            {"role": "system", "content": "你是一名专业的学术编辑，负责随会议进行持续更新会议纪要。"},
+            {"role": "user", "content": _merge_prompt(stored["minutes"] if stored else "", new_records)}
+        ],
+        use_cache=use_cache,
+        max_tokens=MINUTES_MAX_TOKENS,
+    ).strip()
+    message_count = (stored["message_count"] if stored else 0) + len(new_messages)
+    save_minutes(session_id, minutes, new_messages[-1]["id"], message_count)
+    return get_minutes(session_id)
+
+
+def _run_updates(api_key: str, base_url: Optional[str], model: str, session_id: str, min_new: int):
+    client = get_client(api_key, base_url)
+    while True:
+        try:
+            update_minutes(client, model, session_id, min_new=min_new)
+        except Exception as e:
+            print(f"更新纪要失败: {e}")
+        with _lock:
+            # 运行期间又有新的更新请求，再跑一次
+            if session_id not in _dirty:
+                _running.discard(session_id)
+                return
+            _dirty.discard(session_id)
+
+
+def schedule_minutes_update(api_key: str, base_url: Optional[str], model: str, session_id: str,
+                            min_new: int = MINUTES_UPDATE_EVERY):
+    """在后台检查并更新纪要，立即返回 (可以在每次有新消息后随手调用)"""
+    with _lock:
+        if session_id in _running:
+            _dirty.add(session_id)
+            return
+        _running.add(session_id)
+    _minutes_pool.submit(_run_updates, api_key, base_url, model, session_id, min_new)
+
+
+def minutes_context(minutes: Optional[Dict], pending: List[Dict]) -> str:
+    """润色用的上下文：已有纪要 + 尚未整理的少量新消息"""
+    parts = []
+    if minutes:
+        parts.append(f"【已整理的纪要】\n{minutes['minutes']}")
+    if pending:
+        parts.append("【之后的新发言】\n" + "\n".join(transcript_lines(pending)))
+    return "\n\n".join(parts)
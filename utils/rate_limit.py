@@ -0,0 +1,190 @@
+# utils/rate_limit.py
+"""
+客户端限流与重试
+
+每个 (base_url, model) 一个令牌桶限流器，同时限制每分钟请求数 (RPM) 和每分钟 token 数 (TPM)，
+进程内所有调用共享。遇到 429 / 超时 / 5xx 时按带抖动的指数退避重试，
+服务端给了 Retry-After 就按它等待，并让同一服务商的其他请求也一起暂停。
+"""
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import openai
+
+T = TypeVar("T")
+
+# 默认额度 (可按服务商 / 模型用 set_rate_limit 调整)
+DEFAULT_RPM = 60
+DEFAULT_TPM = 100000
+# 估算 token 时给回答预留的长度
+DEFAULT_COMPLETION_TOKENS = 512
+
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0    # 第一次重试前的平均等待 (秒)
+RETRY_MAX_DELAY = 30.0
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class TokenBucket:
+    """令牌桶：按预约方式扣减，返回需要等待的秒数，不在锁里睡眠"""
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            # 单次请求超过桶容量时按容量计，否则永远拿不到
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+
+class RateLimiter:
+    def __init__(self, rpm: float = DEFAULT_RPM, tpm: float = DEFAULT_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        # 统计
+        self.calls = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+
+    def reserve(self, tokens: int) -> float:
+        """预约一次请求，返回需要等待的秒数"""
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        with self._lock:
+            wait = max(wait, self._blocked_until - time.monotonic())
+            self.calls += 1
+            self.throttled_seconds += max(0.0, wait)
+        return max(0.0, wait)
+
+    def acquire(self, tokens: int):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """服务端要求等待时，让共用这个限流器的所有请求都暂停"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "throttled_seconds": round(self.throttled_seconds, 2),
+            }
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limits: Dict[Tuple[str, str], Tuple[float, float]] = {}
+_limiters_lock = threading.Lock()
+
+
+def set_rate_limit(base_url: Optional[str], model: str, rpm: float, tpm: float):
+    """设置某服务商 / 模型的额度 (会替换已有的限流器)"""
+    key = (str(base_url or ""), model)
+    with _limiters_lock:
+        _limits[key] = (rpm, tpm)
+        _limiters[key] = RateLimiter(rpm, tpm)
+
+
+def get_rate_limiter(base_url: Optional[str], model: str) -> RateLimiter:
+    key = (str(base_url or ""), model)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(*_limits.get(key, (DEFAULT_RPM, DEFAULT_TPM)))
+            _limiters[key] = limiter
+        return limiter
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status in RETRYABLE_STATUS or (status is not None and status >= 500)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """从响应头读取服务端建议的等待时间 (retry-after-ms / retry-after)"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """第 attempt 次重试前的等待时间：有 Retry-After 按它来，否则用 full jitter 指数退避"""
+    if retry_after is not None:
+        return min(retry_after, RETRY_MAX_DELAY) + random.uniform(0, 0.5)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def _on_retryable_error(limiter: RateLimiter, error: Exception, attempt: int) -> float:
+    retry_after = retry_after_seconds(error)
+    delay = backoff_delay(attempt, retry_after)
+    if retry_after is not None or isinstance(error, openai.RateLimitError):
+        limiter.pause(delay)
+    with limiter._lock:
+        limiter.retries += 1
+    return delay
+
+
+def call_with_retry(fn: Callable[[], T], limiter: RateLimiter, tokens: int) -> T:
+    """限流后调用 fn，可重试的错误按退避策略重试，其余错误直接抛出"""
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        limiter.acquire(tokens)
+        try:
+            return fn()
+        except Exception as e:
+            if not is_retryable(e) or attempt == RETRY_MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(_on_retryable_error(limiter, e, attempt))
+
+
+async def acall_with_retry(fn: Callable[[], Awaitable[T]], limiter: RateLimiter, tokens: int) -> T:
+    """异步版本的 call_with_retry"""
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        await limiter.aacquire(tokens)
+        try:
+            return await fn()
+        except Exception as e:
+            if not is_retryable(e) or attempt == RETRY_MAX_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(_on_retryable_error(limiter, e, attempt))
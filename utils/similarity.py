@@ -0,0 +1,157 @@
+# utils/similarity.py
+"""
+近重复文本检测 (MinHash + LSH，纯本地计算)
+
+把文本切成字符 n-gram，用 MinHash 压成固定长度的签名，再分段 (band) 放进哈希桶。
+查询时只和同桶的候选比较，集合变大时查重开销基本不变；候选再用 n-gram 的 Jaccard 相似度精确确认。
+适合中文短句的改写判重 (例如大模型反复换说法提出的同一条共识)。
+
+字面相似度分不清"中文语料 / 英文语料"、"是 / 不是" 这类只差一两个字的对立说法，
+所以确认时还要求：否定词一致、没有替换成对立的字或不同的数字 / 英文词，且被替换的实词不多 (见 compatible)。
+"""
+import random
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+SHINGLE_SIZE = 2
+NUM_PERM = 64
+LSH_BANDS = 32               # 32 段 x 2 行，相似度约 0.2 以上的候选大概率同桶
+SIMILARITY_THRESHOLD = 0.5   # n-gram Jaccard 相似度达到这个值视为重复 (还需通过 compatible 检查)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_rng = random.Random(20240601)   # 固定种子，签名在不同进程间一致
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+# 改写时常被增删、不影响意思的虚词
+FUNCTION_CHARS = set("的了是在都也很更加还又就而且并及与和其这那个之对于把被将有所")
+NEGATION_CHARS = set("不没无非未别勿否")
+# 同组内的字互相替换时意思相反或指向不同对象，字面再像也不合并
+CONTRAST_GROUPS = [
+    "中英日韩", "大小", "高低", "多少", "增减", "升降", "上下", "前后", "强弱", "好坏差", "优劣",
+    "长短", "快慢", "新旧", "正负", "真假", "对错", "难易", "早晚", "主次", "内外",
+]
+_CONTRAST_GROUP_OF = {ch: i for i, group in enumerate(CONTRAST_GROUPS) for ch in group}
+# 允许被替换的实词数：至少 PARAPHRASE_MAX_SUBSTITUTIONS 个字，长句按较短一句的长度比例放宽
+PARAPHRASE_MAX_SUBSTITUTIONS = 2
+PARAPHRASE_MAX_SUBSTITUTION_RATIO = 0.2
+
+# 判重时忽略的字符：空白和常见标点
+_IGNORED_RE = re.compile(r"[\s，。！？、；：,.!?;:\"'“”‘’（）()【】\[\]《》<>·…—-]+")
+_ALNUM_RE = re.compile(r"[0-9a-z]+(?:\.[0-9]+)?")
+
+
+def normalize(text: str) -> str:
+    return _IGNORED_RE.sub("", text.lower())
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    text = normalize(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def compatible(a: str, b: str) -> bool:
+    """
+    字面相近的两句是否可能是同一个意思 (调用前 n-gram Jaccard 已经达到阈值)
+    改写时常见的少量换词 (可以 / 能够、仍然 / 依然) 和一方补充的内容都允许；以下情况不合并：
+    - 否定词不一致："模型是有效的" / "模型不是有效的"
+    - 替换成对立的字："在中文语料上效果更好" / "在英文语料上效果更好"、"数据越多越好" / "数据越少越好"
+    - 数字或英文词不同："GPT-4 表现更好" / "GPT-3 表现更好"、"提升 15%" / "提升 51%"
+    - 双方替换的实词太多 (超过 PARAPHRASE_MAX_SUBSTITUTIONS 个字或较短一句的 PARAPHRASE_MAX_SUBSTITUTION_RATIO)
+    会合并的例子："评测基准存在数据污染问题" / "现有评测基准可能存在数据污染"
+    """
+    a_norm, b_norm = normalize(a), normalize(b)
+    a_only, b_only = set(a_norm) - set(b_norm), set(b_norm) - set(a_norm)
+    if (a_only | b_only) & NEGATION_CHARS:
+        return False
+    a_groups = {_CONTRAST_GROUP_OF[ch] for ch in a_only if ch in _CONTRAST_GROUP_OF}
+    if a_groups & {_CONTRAST_GROUP_OF[ch] for ch in b_only if ch in _CONTRAST_GROUP_OF}:
+        return False
+    # 数字 / 英文词按整词比较：只有一方补充没问题，双方各有对方没有的就是换了
+    a_words, b_words = set(_ALNUM_RE.findall(a_norm)), set(_ALNUM_RE.findall(b_norm))
+    if (a_words - b_words) and (b_words - a_words):
+        return False
+    # 一方多出、另一方没有对应的字是补充说明；双方都多出的部分按较少的一方算作被替换的字
+    substituted = min(len(a_only - FUNCTION_CHARS), len(b_only - FUNCTION_CHARS))
+    allowed = max(PARAPHRASE_MAX_SUBSTITUTIONS, int(min(len(a_norm), len(b_norm)) * PARAPHRASE_MAX_SUBSTITUTION_RATIO))
+    return substituted <= allowed
+
+
+def minhash(grams: Set[str]) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(g.encode("utf-8")) for g in grams]
+    if not hashes:
+        return (_MAX_HASH,) * NUM_PERM
+    return tuple(
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+class NearDuplicateIndex:
+    """
+    近重复索引
+    index.add(key, text) 加入；index.find(text) 返回最相似的已有 key (没有足够相似的返回 None)
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, bands: int = LSH_BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self._buckets: List[Dict[Tuple[int, ...], Set[Hashable]]] = [defaultdict(set) for _ in range(bands)]
+        self._items: Dict[Hashable, Tuple[str, Set[str], Tuple[int, ...]]] = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key: Hashable):
+        return key in self._items
+
+    def _band_keys(self, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def add(self, key: Hashable, text: str):
+        if key in self._items:
+            self.remove(key)
+        grams = shingles(text)
+        signature = minhash(grams)
+        self._items[key] = (text, grams, signature)
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band][band_key].add(key)
+
+    def remove(self, key: Hashable):
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        for band, band_key in self._band_keys(item[2]):
+            bucket = self._buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][band_key]
+
+    def find(self, text: str) -> Optional[Hashable]:
+        """返回与 text 最相似且达到阈值的 key"""
+        grams = shingles(text)
+        signature = minhash(grams)
+        candidates = set()
+        for band, band_key in self._band_keys(signature):
+            candidates |= self._buckets[band].get(band_key, set())
+
+        best_key, best_score = None, self.threshold
+        for key in candidates:
+            other, other_grams, _ = self._items[key]
+            score = jaccard(grams, other_grams)
+            if score >= best_score and compatible(text, other):
+                best_key, best_score = key, score
+        return best_key
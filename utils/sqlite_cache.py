@@ -0,0 +1,141 @@
+# utils/sqlite_cache.py
+"""
+存放在 scholar.db 里的通用键值缓存
+
+每个缓存一张表，结构统一为 (key TEXT PRIMARY KEY, tag TEXT, value, created_at REAL, last_used REAL)：
+tag 存附加信息 (模型名、压缩编码等)，value 可以是文本或二进制。
+按最近使用时间做 LRU 淘汰，可选过期时间。命中时的 last_used 更新延后批量写入，读缓存只是一次只读查询。
+"""
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from utils.db_utils import db_cursor
+
+CACHE_EVICT_EVERY = 50          # 每写入多少条检查一次容量
+# 命中时 last_used 不必每次都写：比现在早不到这么多秒就不更新 (LRU 不需要秒级精度)，
+# 需要更新的先记在内存里，攒够一批或下次写缓存时一起写入
+CACHE_TOUCH_INTERVAL = 300
+CACHE_TOUCH_BATCH = 64
+
+
+class SQLiteLRUCache:
+    def __init__(self, table: str, label: str, max_entries: int, ttl_seconds: Optional[float] = None,
+                 evict_every: int = CACHE_EVICT_EVERY):
+        """
+        :param table: 缓存表名 (表结构见模块说明，由 db_migrations 创建)
+        :param label: 出错时打印的名字
+        :param ttl_seconds: 超过这个时间的条目视为过期；为空则不过期
+        """
+        self.table = table
+        self.label = label
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._touches: Dict[str, float] = {}   # 待写入的 key -> last_used
+        self._lock = threading.Lock()
+
+    def get_with_tag(self, key: str, record_miss: bool = True) -> Tuple[Any, Optional[str]]:
+        """
+        返回 (value, tag)，未命中时 value 为 None
+        :param record_miss: 为 False 时未命中不计入统计 (调用方随后还会走一次正常的带缓存调用)
+        """
+        now = time.time()
+        try:
+            with db_cursor() as c:
+                c.execute(f"SELECT tag, value, created_at, last_used FROM {self.table} WHERE key = ?", (key,))
+                row = c.fetchone()
+        except sqlite3.Error as e:
+            # 缓存出问题不影响正常调用
+            print(f"读取{self.label}失败: {e}")
+            row = None
+        if row is not None and self.ttl_seconds is not None and now - row["created_at"] > self.ttl_seconds:
+            row = None
+
+        should_flush = False
+        with self._lock:
+            if row is None:
+                self.misses += record_miss
+            else:
+                self.hits += 1
+                if now - row["last_used"] >= CACHE_TOUCH_INTERVAL:
+                    self._touches[key] = now
+                    should_flush = len(self._touches) >= CACHE_TOUCH_BATCH
+        if should_flush:
+            self.flush_touches()
+        return (row["value"], row["tag"]) if row is not None else (None, None)
+
+    def get(self, key: str, record_miss: bool = True) -> Any:
+        return self.get_with_tag(key, record_miss)[0]
+
+    def _take_touches(self):
+        with self._lock:
+            touches, self._touches = self._touches, {}
+        return [(last_used, key) for key, last_used in touches.items()]
+
+    def flush_touches(self):
+        """把攒下的 last_used 更新一次写入"""
+        touches = self._take_touches()
+        if not touches:
+            return
+        try:
+            with db_cursor(commit=True) as c:
+                c.executemany(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", touches)
+        except sqlite3.Error as e:
+            print(f"更新{self.label}使用时间失败: {e}")
+
+    def put(self, key: str, tag: Optional[str], value: Any):
+        if not value:
+            return
+        now = time.time()
+        try:
+            with db_cursor(commit=True) as c:
+                c.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, tag, value, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, tag, value, now, now)
+                )
+                # 反正要写，顺带把攒下的 last_used 更新一起提交
+                c.executemany(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", self._take_touches())
+        except sqlite3.Error as e:
+            print(f"写入{self.label}失败: {e}")
+            return
+
+        with self._lock:
+            self._puts += 1
+            should_evict = self._puts % self.evict_every == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """删除过期条目，并把总数压回 max_entries 以内 (按最近使用时间淘汰)"""
+        self.flush_touches()
+        try:
+            with db_cursor(commit=True) as c:
+                if self.ttl_seconds is not None:
+                    c.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+                c.execute(f"SELECT count(*) FROM {self.table}")
+                overflow = c.fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    c.execute(
+                        f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY last_used ASC LIMIT ?)",
+                        (overflow,)
+                    )
+        except sqlite3.Error as e:
+            print(f"清理{self.label}失败: {e}")
+
+    def clear(self):
+        with db_cursor(commit=True) as c:
+            c.execute(f"DELETE FROM {self.table}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,97 @@
+# utils/summarizer.py
+"""
+长对话的分段归并摘要 (map-reduce)
+
+整段记录放不进一次请求时：按消息边界切成 token 数受控的段，并发摘要每一段，
+部分摘要太长就再分组归并一层，最后得到一份足够短的"压缩记录"交给生成纪要的提示词。
+
+分段从头开始贪心装填，前面的消息不变时切出的段也不变；段摘要的提示词只和段内容有关，
+所以重新生成纪要时，没变的段直接命中大模型响应缓存，只有新增的尾部需要重新摘要。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from utils.chunker import iter_chunks
+from utils.llm_utils import chat_completion
+from utils.token_utils import content_text, estimate_tokens
+
+# 记录不超过这么多 token 时直接整段生成纪要，不做分段
+DIRECT_MAX_TOKENS = 6000
+SEGMENT_TOKENS = 3000
+SEGMENT_SUMMARY_MAX_TOKENS = 600
+# 部分摘要合起来超过这么多 token 时再归并一层
+REDUCE_MAX_TOKENS = 6000
+MAP_MAX_WORKERS = 4
+
+
+def transcript_lines(messages: List[Dict]) -> List[str]:
+    return [f"{m['role']}: {content_text(m['content'])}" for m in messages]
+
+
+def segment_lines(lines: List[str], max_tokens: int = SEGMENT_TOKENS) -> List[str]:
+    """按行 (消息) 边界贪心装段；单条超长的消息单独切开"""
+    segments, current, current_tokens = [], [], 0
+    for line in lines:
+        tokens = estimate_tokens(line)
+        pieces = list(iter_chunks(line, max_tokens=max_tokens)) if tokens > max_tokens else [line]
+        for piece in pieces:
+            piece_tokens = tokens if len(pieces) == 1 else estimate_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                segments.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        segments.append("\n".join(current))
+    return segments
+
+
+def summarize_segment(client, model: str, segment: str, use_cache: bool = True) -> str:
+    """摘要一段记录 (提示词只依赖段内容，便于缓存复用)"""
+    prompt = f"""
+        下面是一段较长对话记录中的一部分。请提炼这一部分的要点，供之后合并成完整纪要。
+
+        【记录片段】
+        {segment}
+
+        【要求】
+        1. 保留发言人、核心观点与论据、提出的问题、达成的结论和仍存在的分歧。
+        2. 删去寒暄和重复内容，不要添加记录中没有的信息。
+        3. 不超过 {SEGMENT_SUMMARY_MAX_TOKENS} 个 token，直接输出要点。
+        """
+    try:
+        return chat_completion(
+            client,
+            model,
+            [
+                {"role": "system", "content": "你负责为长对话的各个片段提炼要点。"},
+                {"role": "user", "content": prompt}
+            ],
+            use_cache=use_cache,
+            max_tokens=SEGMENT_SUMMARY_MAX_TOKENS,
+        ).strip()
+    except Exception as e:
+        # 单段失败时保留截断的原文，不影响其他段
+        print(f"分段摘要失败: {e}")
+        return segment[:SEGMENT_SUMMARY_MAX_TOKENS]
+
+
+def condense_transcript(client, model: str, messages: List[Dict], use_cache: bool = True) -> str:
+    """
+    把对话记录压缩到适合一次请求的长度
+    短记录原样返回；长记录返回各段摘要拼成的文本 (必要时多层归并)
+    """
+    lines = transcript_lines(messages)
+    text = "\n".join(lines)
+    if estimate_tokens(text) <= DIRECT_MAX_TOKENS:
+        return text
+
+    segments = segment_lines(lines, SEGMENT_TOKENS)
+    with ThreadPoolExecutor(max_workers=MAP_MAX_WORKERS) as pool:
+        while True:
+            summaries = list(pool.map(lambda seg: summarize_segment(client, model, seg, use_cache), segments))
+            condensed = "\n\n".join(f"【第 {i} 部分要点】\n{s}" for i, s in enumerate(summaries, 1))
+            if len(summaries) == 1 or estimate_tokens(condensed) <= REDUCE_MAX_TOKENS:
+                return condensed
+            # 部分摘要仍然太长：按同样的方式分组再归并一层
+            segments = segment_lines(summaries, SEGMENT_TOKENS)
@@ -0,0 +1,88 @@
+# utils/token_utils.py
+"""
+Token 数量估算与各模型的上下文预算
+
+装了 tiktoken 时用 cl100k_base 精确计数；否则用启发式估算：
+中日韩字符约 1 token/字，其余字符约 4 字符/token。各家模型分词器不同，估算只用于控制预算。
+"""
+import re
+from typing import Dict, List, Union
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # 未安装或无法下载词表时退回启发式
+    _encoding = None
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+# 一张图片大致按这么多 token 计 (各家计费方式不同，取一个保守值)
+IMAGE_TOKENS = 1000
+# 每条消息的格式开销 (role、分隔符等)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 常见模型的上下文窗口 (token)，按名称前缀匹配
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "qwen-plus": 131072,
+    "qwen-max": 32768,
+    "qwen-turbo": 131072,
+    "qwen3": 131072,
+    "deepseek": 65536,
+    "moonshot-v1-8k": 8192,
+    "moonshot-v1-32k": 32768,
+    "moonshot-v1-128k": 131072,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# 对话历史的工作预算上限：即使模型窗口很大，也不让每轮请求无限增长
+MAX_HISTORY_BUDGET = 12000
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def content_text(content: Union[str, List[Dict]]) -> str:
+    """取出消息内容中的文字部分 (图文混合消息中的图片记为 [图片])"""
+    if isinstance(content, list):
+        parts = []
+        for item in content:
+            if item.get("type") == "text":
+                parts.append(item.get("text", ""))
+            elif item.get("type") == "image_url":
+                parts.append("[图片]")
+        return "".join(parts)
+    return str(content)
+
+
+def message_tokens(message: Dict) -> int:
+    content = message.get("content", "")
+    tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(content_text(content))
+    if isinstance(content, list):
+        tokens += IMAGE_TOKENS * sum(1 for item in content if item.get("type") == "image_url")
+    return tokens
+
+
+def messages_tokens(messages: List[Dict]) -> int:
+    return sum(message_tokens(m) for m in messages)
+
+
+def context_window(model: str) -> int:
+    # 前缀越长越具体，优先匹配
+    for prefix in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(prefix):
+            return MODEL_CONTEXT_WINDOWS[prefix]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def history_budget(model: str) -> int:
+    """对话历史可用的 token 预算：窗口的一半 (另一半留给回答)，且不超过 MAX_HISTORY_BUDGET"""
+    return min(context_window(model) // 2, MAX_HISTORY_BUDGET)